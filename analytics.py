@@ -0,0 +1,348 @@
+"""Durable store for quiz attempts and answers.
+
+AnalyticsStore is the interface the pages, the stats API and rescore.py use.
+There are two implementations:
+
+- SQLiteAnalyticsStore keeps one SQLite file, shared by the workers on a
+  host. Writes are queued in memory and flushed in batches (by size, by age,
+  or before any read from the same process). Each batch is one transaction
+  that also updates the per-user and per-question aggregate tables.
+- StateAnalyticsStore keeps the same records and aggregates in the shared
+  StateStore, so every node reads the same history.
+
+Pages and the stats API read the aggregates instead of re-scanning raw
+records.
+"""
+import json
+import sqlite3
+from pathlib import Path
+
+from helpers import BatchWriter, LocalConnection
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    quiz_id TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    score INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    percentage REAL NOT NULL,
+    wrong_count INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_attempts_user_quiz ON attempts (user_id, quiz_id, attempt);
+
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    quiz_id TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    question_number INTEGER NOT NULL,
+    user_answer TEXT,
+    correct INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_answers_user_quiz ON answers (user_id, quiz_id);
+CREATE INDEX IF NOT EXISTS idx_answers_question ON answers (quiz_id, question_number);
+
+CREATE TABLE IF NOT EXISTS user_quiz_stats (
+    user_id TEXT NOT NULL,
+    quiz_id TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    total_questions INTEGER NOT NULL DEFAULT 0,
+    total_correct INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, quiz_id)
+);
+
+CREATE TABLE IF NOT EXISTS user_question_stats (
+    user_id TEXT NOT NULL,
+    quiz_id TEXT NOT NULL,
+    question_number INTEGER NOT NULL,
+    wrong INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, quiz_id, question_number)
+);
+
+CREATE TABLE IF NOT EXISTS question_stats (
+    quiz_id TEXT NOT NULL,
+    question_number INTEGER NOT NULL,
+    answered INTEGER NOT NULL DEFAULT 0,
+    wrong INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (quiz_id, question_number)
+);
+CREATE INDEX IF NOT EXISTS idx_question_stats_wrong ON question_stats (quiz_id, wrong DESC);
+"""
+
+
+class AnalyticsStore:
+    def record_answer(self, user_id, quiz_id, attempt, question_number, user_answer, correct, timestamp):
+        raise NotImplementedError
+
+    def record_attempt(self, user_id, quiz_record):
+        raise NotImplementedError
+
+    def flush(self):
+        """Write anything queued; stores that write through have nothing to do"""
+
+    def attempt_history(self, user_id, quiz_id):
+        """[{attempt, score, total, percentage, wrong_count, timestamp, quiz_id}] in attempt order"""
+        raise NotImplementedError
+
+    def user_summary(self, user_id, quiz_id):
+        """{attempts, total_questions, total_correct, percentage} over one user's attempts"""
+        raise NotImplementedError
+
+    def user_wrong_counts(self, user_id, quiz_id, min_wrong=1):
+        """[(question_number, wrong_count)] for one user, most-missed first"""
+        raise NotImplementedError
+
+    def most_missed(self, quiz_id, limit=10):
+        """[{question_number, answered, wrong, miss_rate}]: the most wrong answers across all users"""
+        raise NotImplementedError
+
+    def reset_user(self, user_id, quiz_id):
+        """Forget one user's records for a quiz; cross-user question stats are kept"""
+        raise NotImplementedError
+
+    def export_answers(self):
+        """Yield every recorded answer as a dict, grouped by user, quiz and attempt"""
+        raise NotImplementedError
+
+
+class SQLiteAnalyticsStore(BatchWriter, AnalyticsStore):
+    flusher_name = 'analytics-flusher'
+
+    def __init__(self, path, batch_size=100, flush_interval=1.0):
+        super().__init__(flush_interval, batch_size)
+        self.path = str(path)
+        self._pending_answers = []
+        self._pending_attempts = []
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._connect = LocalConnection(self.path, row_factory=sqlite3.Row)
+        self._connect().executescript(SCHEMA)
+
+    def _enqueue(self, queue, row):
+        with self._lock:
+            queue.append(row)
+        self._queued()
+
+    def record_answer(self, user_id, quiz_id, attempt, question_number, user_answer, correct, timestamp):
+        self._enqueue(self._pending_answers,
+                      (user_id, quiz_id, attempt, question_number, user_answer, int(correct), timestamp))
+
+    def record_attempt(self, user_id, quiz_record):
+        r = quiz_record
+        self._enqueue(self._pending_attempts,
+                      (user_id, r['quiz_id'], r['attempt'], r['score'], r['total'],
+                       r['percentage'], r['wrong_count'], r['timestamp']))
+
+    def _pending_count(self):
+        return len(self._pending_answers) + len(self._pending_attempts)
+
+    def _take_batch(self):
+        if not self._pending_answers and not self._pending_attempts:
+            return None
+        batch = (self._pending_answers, self._pending_attempts)
+        self._pending_answers, self._pending_attempts = [], []
+        return batch
+
+    def _restore_batch(self, batch):
+        answers, attempts = batch
+        self._pending_answers[:0] = answers
+        self._pending_attempts[:0] = attempts
+
+    def _write_batch(self, batch):
+        """Write queued records and update aggregates in one transaction"""
+        answers, attempts = batch
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'INSERT INTO answers (user_id, quiz_id, attempt, question_number, user_answer, correct, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)', answers)
+            conn.executemany(
+                'INSERT INTO question_stats (quiz_id, question_number, answered, wrong) VALUES (?, ?, 1, ?) '
+                'ON CONFLICT (quiz_id, question_number) DO UPDATE SET '
+                'answered = answered + 1, wrong = wrong + excluded.wrong',
+                [(a[1], a[3], 1 - a[5]) for a in answers])
+            conn.executemany(
+                'INSERT INTO user_question_stats (user_id, quiz_id, question_number, wrong) VALUES (?, ?, ?, 1) '
+                'ON CONFLICT (user_id, quiz_id, question_number) DO UPDATE SET wrong = wrong + 1',
+                [(a[0], a[1], a[3]) for a in answers if not a[5]])
+            conn.executemany(
+                'INSERT INTO attempts (user_id, quiz_id, attempt, score, total, percentage, wrong_count, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', attempts)
+            conn.executemany(
+                'INSERT INTO user_quiz_stats (user_id, quiz_id, attempts, total_questions, total_correct) '
+                'VALUES (?, ?, 1, ?, ?) ON CONFLICT (user_id, quiz_id) DO UPDATE SET '
+                'attempts = attempts + 1, total_questions = total_questions + excluded.total_questions, '
+                'total_correct = total_correct + excluded.total_correct',
+                [(a[0], a[1], a[4], a[3]) for a in attempts])
+
+    def attempt_history(self, user_id, quiz_id):
+        self.flush()
+        rows = self._connect().execute(
+            'SELECT attempt, score, total, percentage, wrong_count, created_at AS timestamp, quiz_id '
+            'FROM attempts WHERE user_id = ? AND quiz_id = ? ORDER BY attempt, id', (user_id, quiz_id))
+        return [dict(row) for row in rows]
+
+    def user_summary(self, user_id, quiz_id):
+        self.flush()
+        row = self._connect().execute(
+            'SELECT attempts, total_questions, total_correct FROM user_quiz_stats '
+            'WHERE user_id = ? AND quiz_id = ?', (user_id, quiz_id)).fetchone()
+        summary = dict(row) if row else {'attempts': 0, 'total_questions': 0, 'total_correct': 0}
+        total = summary['total_questions']
+        summary['percentage'] = round(summary['total_correct'] / total * 100, 2) if total else 0
+        return summary
+
+    def user_wrong_counts(self, user_id, quiz_id, min_wrong=1):
+        self.flush()
+        rows = self._connect().execute(
+            'SELECT question_number, wrong FROM user_question_stats '
+            'WHERE user_id = ? AND quiz_id = ? AND wrong >= ? ORDER BY wrong DESC, question_number',
+            (user_id, quiz_id, min_wrong))
+        return [tuple(row) for row in rows]
+
+    def most_missed(self, quiz_id, limit=10):
+        self.flush()
+        rows = self._connect().execute(
+            'SELECT question_number, answered, wrong FROM question_stats '
+            'WHERE quiz_id = ? AND wrong > 0 ORDER BY wrong DESC, question_number LIMIT ?', (quiz_id, limit))
+        return [dict(row, miss_rate=round(row['wrong'] / row['answered'] * 100, 2)) for row in rows]
+
+    def reset_user(self, user_id, quiz_id):
+        self.flush()
+        conn = self._connect()
+        with conn:
+            for table in ('attempts', 'answers', 'user_quiz_stats', 'user_question_stats'):
+                conn.execute(f'DELETE FROM {table} WHERE user_id = ? AND quiz_id = ?', (user_id, quiz_id))
+
+    def export_answers(self):
+        self.flush()
+        rows = self._connect().execute(
+            'SELECT user_id, quiz_id, attempt, question_number, user_answer, correct, created_at '
+            'FROM answers ORDER BY user_id, quiz_id, attempt, id')
+        for row in rows:
+            yield dict(row, correct=bool(row['correct']))
+
+
+class StateAnalyticsStore(AnalyticsStore):
+    """Attempts, answers and their aggregates in a StateStore shared by every node.
+
+    A list is a counter key '<name>:n', raised with incr, plus one key per
+    item, '<name>:<i>'. Aggregates are counters. Attempts and counters are
+    written through, so the next request sees them on any node. The raw
+    answer log, which only rescore.py reads, goes through set_later
+    (write-behind).
+    """
+
+    def __init__(self, state):
+        self.state = state
+
+    def _append(self, name, value, later=False):
+        """Add value to a list; returns its position (1 for a new list)"""
+        index = self.state.incr(f'{name}:n')
+        (self.state.set_later if later else self.state.set)(f'{name}:{index}', value)
+        return index
+
+    def _items(self, name):
+        count = int(self.state.get(f'{name}:n', cache=False) or 0)
+        values = self.state.get_many([f'{name}:{i}' for i in range(1, count + 1)], cache=False)
+        # An item whose counter is already raised may not be written yet
+        return [value for value in values if value is not None]
+
+    def _drop(self, name):
+        count = int(self.state.get(f'{name}:n', cache=False) or 0)
+        self.state.delete(f'{name}:n')
+        for i in range(1, count + 1):
+            self.state.delete(f'{name}:{i}')
+
+    def _numbers(self, name):
+        """Question numbers listed under name; a list restarted after a reset may repeat one"""
+        return list(dict.fromkeys(int(n) for n in self._items(name)))
+
+    def record_answer(self, user_id, quiz_id, attempt, question_number, user_answer, correct, timestamp):
+        user = f'{user_id}:{quiz_id}'
+        if self.state.incr(f'analytics:answered:{quiz_id}:{question_number}') == 1:
+            self._append(f'analytics:questions:{quiz_id}', str(question_number))
+        if not correct:
+            self.state.incr(f'analytics:wrong:{quiz_id}:{question_number}')
+            if self.state.incr(f'analytics:user_wrong:{user}:{question_number}') == 1:
+                self._append(f'analytics:user_wrong_questions:{user}', str(question_number))
+        record = {'user_id': user_id, 'quiz_id': quiz_id, 'attempt': attempt, 'question_number': question_number,
+                  'user_answer': user_answer, 'correct': bool(correct), 'created_at': timestamp}
+        if self._append(f'analytics:answers:{user}', json.dumps(record, ensure_ascii=False), later=True) == 1:
+            # Index of answer logs, for export
+            self._append('analytics:answer_logs', json.dumps([user_id, quiz_id]))
+
+    def record_attempt(self, user_id, quiz_record):
+        r = quiz_record
+        user = f'{user_id}:{r["quiz_id"]}'
+        self._append(f'analytics:attempts:{user}', json.dumps(
+            {key: r[key] for key in ('attempt', 'score', 'total', 'percentage', 'wrong_count', 'timestamp', 'quiz_id')},
+            ensure_ascii=False))
+        self.state.incr(f'analytics:summary:{user}:attempts')
+        self.state.incr(f'analytics:summary:{user}:total_questions', r['total'])
+        self.state.incr(f'analytics:summary:{user}:total_correct', r['score'])
+
+    def flush(self):
+        self.state.flush()
+
+    def attempt_history(self, user_id, quiz_id):
+        history = [json.loads(item) for item in self._items(f'analytics:attempts:{user_id}:{quiz_id}')]
+        return sorted(history, key=lambda a: a['attempt'])
+
+    def user_summary(self, user_id, quiz_id):
+        fields = ('attempts', 'total_questions', 'total_correct')
+        values = self.state.get_many([f'analytics:summary:{user_id}:{quiz_id}:{f}' for f in fields], cache=False)
+        summary = {f: int(v or 0) for f, v in zip(fields, values)}
+        total = summary['total_questions']
+        summary['percentage'] = round(summary['total_correct'] / total * 100, 2) if total else 0
+        return summary
+
+    def user_wrong_counts(self, user_id, quiz_id, min_wrong=1):
+        user = f'{user_id}:{quiz_id}'
+        numbers = self._numbers(f'analytics:user_wrong_questions:{user}')
+        counts = self.state.get_many([f'analytics:user_wrong:{user}:{n}' for n in numbers], cache=False)
+        rows = [(n, int(c)) for n, c in zip(numbers, counts) if c is not None and int(c) >= min_wrong]
+        return sorted(rows, key=lambda r: (-r[1], r[0]))
+
+    def most_missed(self, quiz_id, limit=10):
+        numbers = self._numbers(f'analytics:questions:{quiz_id}')
+        values = self.state.get_many([f'analytics:{kind}:{quiz_id}:{n}' for n in numbers for kind in ('answered', 'wrong')],
+                                     cache=False)
+        rows = []
+        for n, answered, wrong in zip(numbers, values[::2], values[1::2]):
+            answered, wrong = int(answered or 0), int(wrong or 0)
+            if wrong > 0 and answered > 0:
+                rows.append({'question_number': n, 'answered': answered, 'wrong': wrong,
+                             'miss_rate': round(wrong / answered * 100, 2)})
+        rows.sort(key=lambda r: (-r['wrong'], r['question_number']))
+        return rows[:limit]
+
+    def reset_user(self, user_id, quiz_id):
+        user = f'{user_id}:{quiz_id}'
+        for n in self._numbers(f'analytics:user_wrong_questions:{user}'):
+            self.state.delete(f'analytics:user_wrong:{user}:{n}')
+        for name in ('user_wrong_questions', 'attempts', 'answers'):
+            self._drop(f'analytics:{name}:{user}')
+        for field in ('attempts', 'total_questions', 'total_correct'):
+            self.state.delete(f'analytics:summary:{user}:{field}')
+
+    def export_answers(self):
+        self.flush()
+        logs = sorted(set(tuple(json.loads(item)) for item in self._items('analytics:answer_logs')))
+        for user_id, quiz_id in logs:
+            records = [json.loads(item) for item in self._items(f'analytics:answers:{user_id}:{quiz_id}')]
+            yield from sorted(records, key=lambda r: r['attempt'])
+
+
+def init_analytics(backend, path=None, state=None):
+    """AnalyticsStore for ANALYTICS_BACKEND: 'sqlite' (one file per host) or 'shared' (the StateStore)"""
+    if backend == 'sqlite':
+        return SQLiteAnalyticsStore(path)
+    if backend == 'shared':
+        if state is None:
+            raise ValueError("ANALYTICS_BACKEND 'shared' needs a StateStore")
+        return StateAnalyticsStore(state)
+    raise ValueError(f"Unknown ANALYTICS_BACKEND: {backend}")
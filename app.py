@@ -1,86 +1,271 @@
-from flask import Flask, render_template, request, session, redirect, url_for, jsonify, send_from_directory
-import json
-import random
+from flask import Flask, abort, render_template, request, session, redirect, url_for, jsonify, send_from_directory
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+import logging
 from datetime import datetime
 from pathlib import Path
 import os
+import secrets
+import time
+from analytics import init_analytics
+from images import ImageManifest, clean_image_filename, is_inline_image
+import metrics
+from http_cache import LRUCache, cached_page, conditional_json
+from quiz_manager import QuizManager, default_bank_dir
+from session_store import init_session_store, load_secret_key
+from shared_state import CachedStateStore, SQLiteStateStore
+
+# Startup phases in seconds, shown at /debug; QUIZ_PROFILE_STARTUP=1 also logs them as they finish
+STARTUP = {}
+PROFILE_STARTUP = os.environ.get('QUIZ_PROFILE_STARTUP') == '1'
+if PROFILE_STARTUP:
+    logging.basicConfig(level=logging.INFO)
+_startup_mark = time.perf_counter()
 
 app = Flask(__name__)
-app.secret_key = 'your-secret-key-here'
-
-class QuizManager:
-    def __init__(self, base_path):
-        self.base_path = Path(base_path)
-        self.quizzes = {}
-        self.load_all_quizzes()
-        print(f"QuizManager initialized. Loaded {len(self.quizzes)} quizzes: {list(self.quizzes.keys())}")
-    
-    def load_all_quizzes(self):
-        """Load all available quiz files"""
-        print(f"Looking for quiz files in: {self.base_path}")
-        print(f"Base path exists: {self.base_path.exists()}")
-        
-        if not self.base_path.exists():
-            print(f"Creating directory: {self.base_path}")
-            self.base_path.mkdir(parents=True, exist_ok=True)
-        
-        for i in range(1, 6):  # quiz1 to quiz5
-            quiz_file = self.base_path / f'quiz{i}_questions.json'
-            print(f"Checking for: {quiz_file}")
-            print(f"File exists: {quiz_file.exists()}")
-            
-            if quiz_file.exists():
-                try:
-                    with open(quiz_file, 'r', encoding='utf-8') as f:
-                        quiz_data = json.load(f)
-                        self.quizzes[f'quiz{i}'] = {
-                            'data': quiz_data,
-                            'questions': quiz_data['questions'],
-                            'title': quiz_data.get('title', f'软件测试题库 {i}'),
-                            'file': str(quiz_file)
-                        }
-                        print(f"Successfully loaded {quiz_file} with {len(quiz_data['questions'])} questions")
-                except Exception as e:
-                    print(f"Error loading {quiz_file}: {e}")
-            else:
-                print(f"File not found: {quiz_file}")
-    
-    def get_available_quizzes(self):
-        """Get list of available quizzes"""
-        return {k: {'title': v['title'], 'total_questions': len(v['questions'])} 
-                for k, v in self.quizzes.items()}
-    
-    def get_random_questions(self, quiz_id, count=10):
-        if quiz_id not in self.quizzes:
-            return []
-        questions = self.quizzes[quiz_id]['questions']
-        return random.sample(questions, min(count, len(questions)))
-    
-    def check_answer(self, quiz_id, question_number, user_answer):
-        if quiz_id not in self.quizzes:
-            return False
-        questions = self.quizzes[quiz_id]['questions']
-        question = next((q for q in questions if q['question_number'] == question_number), None)
-        if not question:
-            return False
-        return user_answer.strip() == question['correct_answer'].strip()
-
-# Initialize with absolute path to avoid path issues
+# Every worker and node must sign with the same key: set QUIZ_SECRET_KEY when running several
+# nodes. Otherwise one is generated into the instance folder and shared by the workers on this host.
+app.secret_key = os.environ.get('QUIZ_SECRET_KEY') or load_secret_key(Path(app.instance_path) / 'secret_key')
+# State shared by all nodes (attempt counters and tokens, and sessions and analytics with the
+# 'shared' backends). The SQLite file stands in for a networked store; any StateStore
+# implementation can be swapped in here.
+app.config['STATE_SQLITE_PATH'] = os.environ.get('QUIZ_STATE_SQLITE_PATH') or str(Path(app.instance_path) / 'state.sqlite3')
+state = CachedStateStore(SQLiteStateStore(app.config['STATE_SQLITE_PATH']))
+# Session backend: 'memory' (default), 'sqlite', 'shared' (the state store) or 'cookie' (Flask's signed cookie)
+app.config['SESSION_BACKEND'] = os.environ.get('QUIZ_SESSION_BACKEND', 'memory')
+app.config['SESSION_SQLITE_PATH'] = os.environ.get('QUIZ_SESSION_SQLITE_PATH')
+init_session_store(app, state)
+# Attempt history and answer statistics: 'sqlite' (default; one file shared by the workers on this
+# host) or 'shared' (the state store, so every node reads the same history)
+app.config['ANALYTICS_BACKEND'] = os.environ.get('QUIZ_ANALYTICS_BACKEND', 'sqlite')
+app.config['ANALYTICS_DB'] = os.environ.get('QUIZ_ANALYTICS_DB') or str(Path(app.instance_path) / 'analytics.sqlite3')
+analytics = init_analytics(app.config['ANALYTICS_BACKEND'], app.config['ANALYTICS_DB'], state)
+# Compiled templates are cached on disk so new workers skip Jinja's parse/compile step
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('QUIZ_TEMPLATE_CACHE_DIR') or str(Path(app.instance_path) / 'jinja_cache')
+Path(app.config['TEMPLATE_CACHE_DIR']).mkdir(parents=True, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'])
+metrics.init_app(app)
+
+logger = logging.getLogger('quiz')
+
+def _startup_phase(name):
+    global _startup_mark
+    now = time.perf_counter()
+    STARTUP[name] = round(now - _startup_mark, 4)
+    _startup_mark = now
+    if PROFILE_STARTUP:
+        logger.info("Startup: %s took %.1f ms", name, STARTUP[name] * 1000)
+
+_startup_phase('app_setup')
+
+# Seconds between checks for changed bank files; 0 disables hot reload
+QUIZ_RELOAD_INTERVAL = float(os.environ.get('QUIZ_RELOAD_INTERVAL', '2'))
+
+# Directory holding the <id>_questions.json banks: relative to the working directory,
+# or next to this file when the app is started from elsewhere
+QUIZ_BANK_DIR = default_bank_dir()
+
+# Load banks on a background thread after startup instead of before serving (see create_app)
+BACKGROUND_LOAD = os.environ.get('QUIZ_BACKGROUND_LOAD') == '1'
+
 try:
-    quiz_manager = QuizManager('source_challenges')
-    if not quiz_manager.quizzes:
-        # Try alternative path
-        alt_path = Path(__file__).parent / 'source_challenges'
-        print(f"Trying alternative path: {alt_path}")
-        quiz_manager = QuizManager(str(alt_path))
+    quiz_manager = QuizManager(QUIZ_BANK_DIR, reload_interval=QUIZ_RELOAD_INTERVAL)
 except Exception as e:
-    print(f"Error initializing QuizManager: {e}")
+    logger.error("Error initializing QuizManager: %s", e)
     quiz_manager = None
+_startup_phase('quiz_manager')
+
+MAX_ATTEMPTS = 5
+# Seconds an unfinished attempt's token stays valid
+ATTEMPT_TOKEN_TTL = int(os.environ.get('QUIZ_ATTEMPT_TOKEN_TTL', str(24 * 3600)))
+QUESTIONS_PER_ATTEMPT = 10
+# Most recent wrong answers kept per quiz in the session; older ones live on only as
+# per-question counts in the analytics store
+WRONG_ANSWER_RETENTION = int(os.environ.get('QUIZ_WRONG_ANSWER_RETENTION', '100'))
+
+# Rendered pages keyed by everything they depend on
+page_cache = LRUCache(max_entries=1024)
+# Rendered question bodies, keyed by (quiz_id, question_number, bank version)
+fragment_cache = LRUCache(max_entries=4096)
+
+# Images under static/images, listed for /debug_images only
+static_images = ImageManifest(Path(app.static_folder or Path(__file__).parent / 'static') / 'images')
+
+@app.before_request
+def reload_changed_banks():
+    if quiz_manager:
+        quiz_manager.maybe_reload()
+
+def _user_id():
+    """Stable per-browser ID that analytics records are keyed on"""
+    if 'user_id' not in session:
+        session['user_id'] = secrets.token_hex(16)
+    return session['user_id']
+
+def _ensure_quiz_session(quiz_id):
+    """Make sure the per-quiz session dicts exist (migrating old data if needed)"""
+    for key in ('attempts', 'wrong_answers'):
+        if not isinstance(session.get(key), dict):
+            session[key] = {}
+    session['attempts'].setdefault(quiz_id, 0)
+    records = session['wrong_answers'].setdefault(quiz_id, [])
+    if any(isinstance(r, dict) for r in records):
+        session['wrong_answers'][quiz_id] = [_compact_legacy_record(quiz_id, r) if isinstance(r, dict) else r
+                                             for r in records]
+
+def _attempts_key(quiz_id):
+    return f'attempts:{_user_id()}:{quiz_id}'
+
+def _attempts_used(quiz_id, fresh=False):
+    """Finished attempts from the shared counter, which (unlike the session) a client cannot roll back"""
+    return int(state.get(_attempts_key(quiz_id), cache=not fresh) or 0)
+
+def _attempt_token_key(quiz_id):
+    token = session.get('attempt_token')
+    return f'attempt_token:{_user_id()}:{quiz_id}:{token}' if token else None
+
+def _attempt_is_open(quiz_id):
+    """Whether the session's attempt was started by the server and not finished yet"""
+    key = _attempt_token_key(quiz_id)
+    return key is not None and state.get(key, cache=False) == '0'
+
+def _claim_finish(quiz_id):
+    """Use up the attempt's token and count the attempt; returns its number, or None if the
+    attempt was already finished (e.g. a replayed cookie) or the attempt limit is reached"""
+    key = _attempt_token_key(quiz_id)
+    if key is None or state.get(key, cache=False) is None:
+        return None
+    # The token goes from 0 to 1 exactly once, however many requests race for it;
+    # it is kept (with its expiry restored) so later replays find it used
+    claimed = state.incr(key, limit=1)
+    if claimed is None:
+        return None
+    state.set(key, '1', ttl=ATTEMPT_TOKEN_TTL)
+    return state.incr(_attempts_key(quiz_id), limit=MAX_ATTEMPTS)
+
+def _clear_attempt():
+    for key in ('current_quiz', 'current_question', 'current_score', 'current_wrong',
+                'current_quiz_id', 'attempt_token'):
+        session.pop(key, None)
+
+def _start_attempt(quiz_id):
+    """Draw questions for a new attempt; returns None once the attempt limit is reached"""
+    _ensure_quiz_session(quiz_id)
+    session['attempts'][quiz_id] = _attempts_used(quiz_id, fresh=True)
+    if session['attempts'][quiz_id] >= MAX_ATTEMPTS:
+        return None
+    
+    # Only question numbers go into the session
+    if not isinstance(session.get('seen_questions'), dict):
+        session['seen_questions'] = {}
+    seen = session['seen_questions'].get(quiz_id, [])
+    wrong = [w[0] for w in reversed(session['wrong_answers'][quiz_id])]
+    # The sampler asks unseen questions first and tops up from seen ones only when they run out
+    questions = quiz_manager.get_random_questions(quiz_id, QUESTIONS_PER_ATTEMPT, seen=seen, wrong=wrong)
+    drawn = [q.question_number for q in questions]
+    seen_set = set(seen)
+    if quiz_manager.get_question_numbers(quiz_id) <= seen_set.union(drawn):
+        # Every question has now been asked; the repeats in this draw open the next cycle
+        session['seen_questions'][quiz_id] = [n for n in drawn if n in seen_set]
+    else:
+        session['seen_questions'][quiz_id] = seen + [n for n in drawn if n not in seen_set]
+    session['current_quiz_id'] = quiz_id
+    session['current_quiz'] = [q.question_number for q in questions]
+    session['current_question'] = 0
+    session['current_score'] = 0
+    session['current_wrong'] = []
+    session['attempt_token'] = secrets.token_hex(16)
+    state.set(_attempt_token_key(quiz_id), '0', ttl=ATTEMPT_TOKEN_TTL)
+    return questions
+
+def _answer_ref(quiz_id, question_number, submission):
+    """Chosen option index (a sorted list for several), or the answer text if it names no option"""
+    key = quiz_manager.get_answer_key(quiz_id, question_number)
+    indices = key.normalize(submission) if key else None
+    if indices is None:
+        return submission if isinstance(submission, str) else ''
+    return next(iter(indices)) if len(indices) == 1 else sorted(indices)
+
+def _answer_text(quiz_id, question_number, submission):
+    """Submission as stored in analytics: the option text (letters for several options) or the raw text"""
+    ref = _answer_ref(quiz_id, question_number, submission)
+    if isinstance(ref, str):
+        return ref
+    key = quiz_manager.get_answer_key(quiz_id, question_number)
+    return key.answer_text([ref] if isinstance(ref, int) else ref)
+
+def _wrong_answer_record(question, user_answer, quiz_id, timestamp=None):
+    """Compact session record: [question_number, option index or answer text, epoch seconds, attempt]"""
+    return [question.question_number,
+            _answer_ref(quiz_id, question.question_number, user_answer),
+            int(timestamp if timestamp is not None else time.time()),
+            session['attempts'][quiz_id] + 1]
+
+def _compact_legacy_record(quiz_id, record):
+    """Convert a wrong answer stored by older versions (a dict with copied question text)"""
+    try:
+        epoch = int(datetime.fromisoformat(record['timestamp']).timestamp())
+    except (KeyError, TypeError, ValueError):
+        epoch = 0
+    return [record.get('question_number'),
+            _answer_ref(quiz_id, record.get('question_number'), record.get('user_answer', '')),
+            epoch, record.get('attempt', 0)]
+
+def _add_wrong_answers(quiz_id, records):
+    session['current_wrong'] = session.get('current_wrong', []) + records
+    kept = session['wrong_answers'][quiz_id] + records
+    session['wrong_answers'][quiz_id] = kept[-WRONG_ANSWER_RETENTION:] if WRONG_ANSWER_RETENTION > 0 else []
+
+def _expand_wrong_record(quiz_id, record):
+    """Resolve a compact record against the current bank for display"""
+    question_number, answer, epoch, attempt = record
+    question = quiz_manager.get_question(quiz_id, question_number)
+    key = quiz_manager.get_answer_key(quiz_id, question_number)
+    if not isinstance(answer, str):
+        indices = key.normalize(answer) if key else None
+        answer = key.answer_text(indices) if indices else ''
+    return {
+        'question_number': question_number,
+        'question_text': question.question_text if question else '',
+        'user_answer': answer,
+        'correct_answer': question.correct_answer if question else '',
+        'timestamp': datetime.fromtimestamp(epoch).isoformat() if epoch else '',
+        'attempt': attempt,
+        'quiz_id': quiz_id
+    }
+
+def _record_answer(quiz_id, question, submission, is_correct, timestamp=None):
+    metrics.record_answer(quiz_id, is_correct)
+    analytics.record_answer(_user_id(), quiz_id, session['attempts'][quiz_id] + 1, question.question_number,
+                            _answer_text(quiz_id, question.question_number, submission), is_correct,
+                            timestamp or datetime.now().isoformat())
+
+def _finish_attempt(quiz_id, attempt):
+    """Record the current attempt, claimed as number `attempt`, in the session and analytics store and clear it"""
+    _ensure_quiz_session(quiz_id)
+    score = session.get('current_score', 0)
+    total = len(session['current_quiz'])
+    wrong_answers = [_expand_wrong_record(quiz_id, r) for r in session.get('current_wrong', [])]
+    
+    session['attempts'][quiz_id] = attempt
+    quiz_record = {
+        'attempt': session['attempts'][quiz_id],
+        'score': score,
+        'total': total,
+        'percentage': round((score / total) * 100, 2) if total else 0,
+        'wrong_count': len(wrong_answers),
+        'timestamp': datetime.now().isoformat(),
+        'quiz_id': quiz_id
+    }
+    analytics.record_attempt(_user_id(), quiz_record)
+    
+    _clear_attempt()
+    return quiz_record, wrong_answers
 
 @app.route('/')
 def index():
     # Check if quiz manager is properly initialized
-    if not quiz_manager or not quiz_manager.quizzes:
+    if not quiz_manager or not quiz_manager.banks:
         return render_template('error.html', 
                              error_message="Quiz files could not be loaded.",
                              error_details=f"Please visit /debug for more information. Current working directory: {os.getcwd()}")
@@ -90,8 +275,6 @@ def index():
         session['attempts'] = {}
     if 'wrong_answers' not in session or not isinstance(session['wrong_answers'], dict):
         session['wrong_answers'] = {}
-    if 'quiz_history' not in session or not isinstance(session['quiz_history'], dict):
-        session['quiz_history'] = {}
     
     available_quizzes = quiz_manager.get_available_quizzes()
     
@@ -110,11 +293,13 @@ def index():
         current_quiz = first_quiz_id
         session['selected_quiz'] = current_quiz
     
-    return render_template('index.html', 
-                         available_quizzes=available_quizzes,
-                         current_quiz=current_quiz,
-                         attempts=session['attempts'].get(current_quiz, 0),
-                         max_attempts=5)
+    attempts = session['attempts'].get(current_quiz, 0)
+    return cached_page(page_cache, ('index', quiz_manager.version, current_quiz, attempts),
+                       lambda: render_template('index.html',
+                                               available_quizzes=available_quizzes,
+                                               current_quiz=current_quiz,
+                                               attempts=attempts,
+                                               max_attempts=MAX_ATTEMPTS))
 
 @app.route('/select_quiz', methods=['POST'])
 def select_quiz():
@@ -137,33 +322,9 @@ def start_quiz():
         current_quiz = first_quiz_id
         session['selected_quiz'] = current_quiz
     
-    # Ensure session data structure is consistent
-    if not isinstance(session.get('attempts'), dict):
-        session['attempts'] = {}
-    if not isinstance(session.get('wrong_answers'), dict):
-        session['wrong_answers'] = {}
-    if not isinstance(session.get('quiz_history'), dict):
-        session['quiz_history'] = {}
-    
-    # Initialize quiz-specific session data if not exists
-    if current_quiz not in session['attempts']:
-        session['attempts'][current_quiz] = 0
-    if current_quiz not in session['wrong_answers']:
-        session['wrong_answers'][current_quiz] = []
-    if current_quiz not in session['quiz_history']:
-        session['quiz_history'][current_quiz] = []
-    
-    if session['attempts'][current_quiz] >= 5:
+    if _start_attempt(current_quiz) is None:
         return redirect(url_for('quiz_complete'))
     
-    # Get random questions for this quiz
-    questions = quiz_manager.get_random_questions(current_quiz, 10)
-    session['current_quiz_id'] = current_quiz
-    session['current_quiz'] = questions
-    session['current_question'] = 0
-    session['current_score'] = 0
-    session['current_wrong'] = []
-    
     return redirect(url_for('quiz'))
 
 @app.route('/quiz')
@@ -178,58 +339,66 @@ def quiz():
     if current_q_index >= len(questions):
         return redirect(url_for('quiz_result'))
     
-    question = questions[current_q_index]
+    question = quiz_manager.get_question(current_quiz_id, questions[current_q_index])
+    if question is None:
+        # The bank changed under this attempt; skip the missing question
+        session['current_question'] = current_q_index + 1
+        return redirect(url_for('quiz'))
     
-    # Safer way to get quiz title
-    quiz_title = quiz_manager.quizzes.get(current_quiz_id, {}).get('title', f'Quiz {current_quiz_id}')
+    quiz_title = quiz_manager.get_title(current_quiz_id, f'Quiz {current_quiz_id}')
     
     return render_template('quiz.html', 
-                         question=question,
+                         question_body=_question_body(current_quiz_id, question),
                          question_index=current_q_index + 1,
                          total_questions=len(questions),
                          quiz_title=quiz_title)
 
+def _question_body(quiz_id, question):
+    """Rendered question text, image and answer form; identical for every user, so cached"""
+    key = (quiz_id, question.question_number, quiz_manager.version)
+    body = fragment_cache.get(key)
+    if body is None:
+        body = Markup(render_template('question_body.html',
+                                      question=question,
+                                      display=quiz_manager.get_display(quiz_id, question.question_number),
+                                      image_url=_image_url(question)))
+        fragment_cache.set(key, body)
+    return body
+
 @app.route('/submit_answer', methods=['POST'])
 def submit_answer():
     if 'current_quiz' not in session:
         return redirect(url_for('index'))
     
-    user_answer = request.form.get('answer')
+    # The quiz page posts option indices as 'choice'; 'answer' (option text) is still accepted
+    choices = request.form.getlist('choice')
+    if choices and all(c.isdigit() for c in choices):
+        user_answer = [int(c) for c in choices]
+    else:
+        user_answer = request.form.get('answer', '')
     current_q_index = session['current_question']
     questions = session['current_quiz']
-    current_question = questions[current_q_index]
+    if current_q_index >= len(questions):
+        return redirect(url_for('quiz_result'))
     current_quiz_id = session.get('current_quiz_id', 'quiz1')
+    if not _attempt_is_open(current_quiz_id):
+        # Finished already (a replayed cookie) or expired
+        _clear_attempt()
+        return redirect(url_for('quiz_complete'))
+    current_question = quiz_manager.get_question(current_quiz_id, questions[current_q_index])
+    if current_question is None:
+        session['current_question'] = current_q_index + 1
+        return redirect(url_for('quiz'))
     
-    # Ensure session data structure is consistent
-    if not isinstance(session.get('attempts'), dict):
-        session['attempts'] = {}
-    if not isinstance(session.get('wrong_answers'), dict):
-        session['wrong_answers'] = {}
-    
-    # Initialize if not exists
-    if current_quiz_id not in session['attempts']:
-        session['attempts'][current_quiz_id] = 0
-    if current_quiz_id not in session['wrong_answers']:
-        session['wrong_answers'][current_quiz_id] = []
+    _ensure_quiz_session(current_quiz_id)
     
-    is_correct = quiz_manager.check_answer(current_quiz_id, current_question['question_number'], user_answer)
+    is_correct = quiz_manager.check_answer(current_quiz_id, current_question.question_number, user_answer)
+    _record_answer(current_quiz_id, current_question, user_answer, is_correct)
     
     if is_correct:
         session['current_score'] += 1
     else:
-        wrong_answer_record = {
-            'question_number': current_question['question_number'],
-            'question_text': current_question['question_text'],
-            'user_answer': user_answer,
-            'correct_answer': current_question['correct_answer'],
-            'timestamp': datetime.now().isoformat(),
-            'attempt': session['attempts'][current_quiz_id] + 1,
-            'quiz_id': current_quiz_id
-        }
-        session['current_wrong'].append(wrong_answer_record)
-        
-        # Add to quiz-specific wrong answers
-        session['wrong_answers'][current_quiz_id].append(wrong_answer_record)
+        _add_wrong_answers(current_quiz_id, [_wrong_answer_record(current_question, user_answer, current_quiz_id)])
     
     session['current_question'] += 1
     return redirect(url_for('quiz'))
@@ -239,54 +408,22 @@ def quiz_result():
     if 'current_quiz' not in session:
         return redirect(url_for('index'))
     
-    score = session.get('current_score', 0)
-    total = len(session['current_quiz'])
-    wrong_answers = session.get('current_wrong', [])
     current_quiz_id = session.get('current_quiz_id', 'quiz1')
+    attempt = _claim_finish(current_quiz_id)
+    if attempt is None:
+        _clear_attempt()
+        return redirect(url_for('quiz_complete'))
+    quiz_record, wrong_answers = _finish_attempt(current_quiz_id, attempt)
     
-    # Ensure session data structure is consistent
-    if not isinstance(session.get('attempts'), dict):
-        session['attempts'] = {}
-    if not isinstance(session.get('quiz_history'), dict):
-        session['quiz_history'] = {}
-    
-    # Initialize if not exists
-    if current_quiz_id not in session['attempts']:
-        session['attempts'][current_quiz_id] = 0
-    if current_quiz_id not in session['quiz_history']:
-        session['quiz_history'][current_quiz_id] = []
-    
-    # Record this attempt
-    session['attempts'][current_quiz_id] = session['attempts'][current_quiz_id] + 1
-    
-    quiz_record = {
-        'attempt': session['attempts'][current_quiz_id],
-        'score': score,
-        'total': total,
-        'percentage': round((score / total) * 100, 2),
-        'wrong_count': len(wrong_answers),
-        'timestamp': datetime.now().isoformat(),
-        'quiz_id': current_quiz_id
-    }
-    
-    session['quiz_history'][current_quiz_id].append(quiz_record)
-    
-    # Clear current quiz data
-    session.pop('current_quiz', None)
-    session.pop('current_question', None)
-    session.pop('current_score', None)
-    session.pop('current_wrong', None)
-    session.pop('current_quiz_id', None)
-    
-    quiz_title = quiz_manager.quizzes.get(current_quiz_id, {}).get('title', f'Quiz {current_quiz_id}')
+    quiz_title = quiz_manager.get_title(current_quiz_id, f'Quiz {current_quiz_id}')
     
     return render_template('result.html', 
-                         score=score,
-                         total=total,
+                         score=quiz_record['score'],
+                         total=quiz_record['total'],
                          percentage=quiz_record['percentage'],
                          wrong_answers=wrong_answers,
-                         attempt=session['attempts'][current_quiz_id],
-                         max_attempts=5,
+                         attempt=quiz_record['attempt'],
+                         max_attempts=MAX_ATTEMPTS,
                          quiz_title=quiz_title)
 
 @app.route('/wrong_answers')
@@ -294,71 +431,75 @@ def wrong_answers():
     current_quiz = session.get('selected_quiz', 'quiz1')
     
     # Ensure session data structure is consistent
-    if not isinstance(session.get('wrong_answers'), dict):
-        session['wrong_answers'] = {}
+    _ensure_quiz_session(current_quiz)
     
-    wrong_answers = session['wrong_answers'].get(current_quiz, [])
-    quiz_title = quiz_manager.quizzes.get(current_quiz, {}).get('title', 'Quiz')
+    wrong_answers = [_expand_wrong_record(current_quiz, r) for r in session['wrong_answers'][current_quiz]]
+    # Older wrong answers beyond the retention limit only survive as counts
+    total_wrong = sum(count for _, count in analytics.user_wrong_counts(_user_id(), current_quiz))
+    quiz_title = quiz_manager.get_title(current_quiz)
     
     return render_template('wrong_answers.html', 
                          wrong_answers=wrong_answers,
+                         total_wrong=max(total_wrong, len(wrong_answers)),
                          quiz_title=quiz_title,
                          available_quizzes=quiz_manager.get_available_quizzes(),
                          current_quiz=current_quiz)
 
+def _user_page_key(name, user_id, quiz_id):
+    """Cache key (and ETag) of a per-user page built from the analytics store.
+    
+    The data only changes when an attempt finishes, which changes the attempt count, or on a
+    reset, which sets the count back and so bumps the page generation to keep old keys unused.
+    """
+    attempts = (session.get('attempts') or {}).get(quiz_id, 0)
+    return (name, quiz_manager.version, user_id, quiz_id, attempts, session.get('page_generation', 0))
+
+def _bump_page_generation():
+    session['page_generation'] = session.get('page_generation', 0) + 1
+
 @app.route('/quiz_history')
 def quiz_history():
     current_quiz = session.get('selected_quiz', 'quiz1')
     
-    # Ensure session data structure is consistent
-    if not isinstance(session.get('quiz_history'), dict):
-        session['quiz_history'] = {}
+    user_id = _user_id()
     
-    history = session['quiz_history'].get(current_quiz, [])
-    quiz_title = quiz_manager.quizzes.get(current_quiz, {}).get('title', 'Quiz')
+    def render():
+        return render_template('history.html', 
+                               history=analytics.attempt_history(user_id, current_quiz),
+                               quiz_title=quiz_manager.get_title(current_quiz),
+                               available_quizzes=quiz_manager.get_available_quizzes(),
+                               current_quiz=current_quiz)
     
-    return render_template('history.html', 
-                         history=history,
-                         quiz_title=quiz_title,
-                         available_quizzes=quiz_manager.get_available_quizzes(),
-                         current_quiz=current_quiz)
+    return cached_page(page_cache, _user_page_key('history', user_id, current_quiz), render)
 
 @app.route('/quiz_complete')
 def quiz_complete():
     current_quiz = session.get('selected_quiz', 'quiz1')
     
-    # Ensure session data structure is consistent
-    if not isinstance(session.get('quiz_history'), dict):
-        session['quiz_history'] = {}
-    if not isinstance(session.get('wrong_answers'), dict):
-        session['wrong_answers'] = {}
-    
-    history = session['quiz_history'].get(current_quiz, [])
-    wrong_answers = session['wrong_answers'].get(current_quiz, [])
-    
-    # Calculate statistics
-    total_questions = sum(h['total'] for h in history)
-    total_correct = sum(h['score'] for h in history)
-    overall_percentage = round((total_correct / total_questions) * 100, 2) if total_questions > 0 else 0
-    
-    # Group wrong answers by question
-    wrong_by_question = {}
-    for wrong in wrong_answers:
-        q_num = wrong['question_number']
-        if q_num not in wrong_by_question:
-            wrong_by_question[q_num] = []
-        wrong_by_question[q_num].append(wrong)
-    
-    quiz_title = quiz_manager.quizzes.get(current_quiz, {}).get('title', 'Quiz')
-    
-    return render_template('complete.html',
-                         history=history,
-                         wrong_answers=wrong_answers,
-                         wrong_by_question=wrong_by_question,
-                         total_questions=total_questions,
-                         total_correct=total_correct,
-                         overall_percentage=overall_percentage,
-                         quiz_title=quiz_title)
+    user_id = _user_id()
+    
+    def render():
+        summary = analytics.user_summary(user_id, current_quiz)
+        # Questions missed at least twice, from the precomputed per-user counts
+        review_questions = []
+        for q_num, wrong_count in analytics.user_wrong_counts(user_id, current_quiz, min_wrong=2):
+            question = quiz_manager.get_question(current_quiz, q_num)
+            if question is not None:
+                review_questions.append({
+                    'question_number': q_num,
+                    'wrong_count': wrong_count,
+                    'question_text': question.question_text,
+                    'correct_answer': question.correct_answer
+                })
+        return render_template('complete.html',
+                               history=analytics.attempt_history(user_id, current_quiz),
+                               review_questions=review_questions,
+                               total_questions=summary['total_questions'],
+                               total_correct=summary['total_correct'],
+                               overall_percentage=summary['percentage'],
+                               quiz_title=quiz_manager.get_title(current_quiz))
+    
+    return cached_page(page_cache, _user_page_key('complete', user_id, current_quiz), render)
 
 @app.route('/reset')
 def reset():
@@ -369,22 +510,29 @@ def reset():
         session['attempts'] = {}
     if not isinstance(session.get('wrong_answers'), dict):
         session['wrong_answers'] = {}
-    if not isinstance(session.get('quiz_history'), dict):
-        session['quiz_history'] = {}
     
     # Reset only current quiz data
     if current_quiz in session['attempts']:
         session['attempts'][current_quiz] = 0
+    state.delete(_attempts_key(current_quiz))
     if current_quiz in session['wrong_answers']:
         session['wrong_answers'][current_quiz] = []
-    if current_quiz in session['quiz_history']:
-        session['quiz_history'][current_quiz] = []
+    analytics.reset_user(_user_id(), current_quiz)
+    if isinstance(session.get('seen_questions'), dict):
+        session['seen_questions'].pop(current_quiz, None)
+    _bump_page_generation()
     
     return redirect(url_for('index'))
 
 @app.route('/reset_all')
 def reset_all():
+    if isinstance(session.get('attempts'), dict) and 'user_id' in session:
+        for quiz_id in session['attempts']:
+            state.delete(_attempts_key(quiz_id))
+    generation = session.get('page_generation', 0)
     session.clear()
+    session['page_generation'] = generation
+    _bump_page_generation()
     return redirect(url_for('index'))
 
 @app.route('/api/stats')
@@ -396,98 +544,259 @@ def api_stats():
         session['attempts'] = {}
     if not isinstance(session.get('wrong_answers'), dict):
         session['wrong_answers'] = {}
-    if not isinstance(session.get('quiz_history'), dict):
-        session['quiz_history'] = {}
     
-    return jsonify({
+    user_id = _user_id()
+    return conditional_json({
         'current_quiz': current_quiz,
         'attempts': session['attempts'].get(current_quiz, 0),
         'wrong_answers_count': len(session['wrong_answers'].get(current_quiz, [])),
-        'quiz_history': session['quiz_history'].get(current_quiz, []),
+        'quiz_history': analytics.attempt_history(user_id, current_quiz),
+        'summary': analytics.user_summary(user_id, current_quiz),
         'all_attempts': session['attempts'],
         'available_quizzes': quiz_manager.get_available_quizzes()
     })
 
+@app.route('/api/stats/most_missed')
+def api_most_missed():
+    """Most-missed questions across all users, from the aggregate table"""
+    quiz_id = request.args.get('quiz_id') or session.get('selected_quiz', 'quiz1')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    rows = analytics.most_missed(quiz_id, limit)
+    for row in rows:
+        question = quiz_manager.get_question(quiz_id, row['question_number'])
+        row['question_text'] = question.question_text if question else None
+    return jsonify({'quiz_id': quiz_id, 'questions': rows})
+
+@app.route('/api/search')
+def api_search():
+    """Ranked full-text search over question text and options, across all banks or ?quiz_id="""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing query parameter q'}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), 100))
+    quiz_ids = request.args.getlist('quiz_id') or None
+    # The index covers loaded banks; make sure all of them are
+    quiz_manager.load_all_quizzes()
+    results = []
+    for score, quiz_id, number in quiz_manager.search.search(query, quiz_ids, limit):
+        question = quiz_manager.get_question(quiz_id, number)
+        if question is not None:
+            results.append({'quiz_id': quiz_id, 'question_number': number, 'score': score,
+                            'question_text': question.question_text, 'options': list(question.options)})
+    return jsonify({'query': query, 'results': results})
+
+def _image_url(question):
+    """Content-hashed URL for a question's image, or None"""
+    if not (question.has_image and question.image_src):
+        return None
+    if is_inline_image(question.image_src):
+        return question.image_src
+    info = quiz_manager.images.for_question(question)
+    if info is None:
+        # Unknown to the manifest (missing file); let the route report it
+        return url_for('quiz_images', filename=clean_image_filename(question.image_src))
+    return url_for('quiz_images', filename=info.filename, v=info.digest)
+
+def _question_payload(question):
+    """Question fields a client needs to render it, without the answer"""
+    payload = {
+        'question_number': question.question_number,
+        'question_text': question.question_text,
+        'options': list(question.options),
+        'multiple': quiz_manager.get_display(session.get('current_quiz_id'), question.question_number)['multiple'],
+        'has_image': question.has_image
+    }
+    if question.has_image:
+        payload['image_url'] = _image_url(question)
+        payload['image_alt'] = question.image_alt
+    return payload
+
+@app.route('/api/start_attempt', methods=['POST'])
+def api_start_attempt():
+    """Start an attempt and return all of its questions at once"""
+    data = request.get_json(silent=True) or {}
+    available_quizzes = quiz_manager.get_available_quizzes()
+    quiz_id = data.get('quiz_id') or session.get('selected_quiz')
+    if quiz_id not in available_quizzes:
+        if data.get('quiz_id') or not available_quizzes:
+            return jsonify({'error': 'Unknown quiz', 'quiz_id': quiz_id}), 404
+        quiz_id = next(iter(available_quizzes))
+    session['selected_quiz'] = quiz_id
+    
+    questions = _start_attempt(quiz_id)
+    if questions is None:
+        return jsonify({'error': 'Maximum attempts reached', 'max_attempts': MAX_ATTEMPTS}), 409
+    
+    return jsonify({
+        'quiz_id': quiz_id,
+        'quiz_title': quiz_manager.get_title(quiz_id),
+        'attempt': session['attempts'][quiz_id] + 1,
+        'max_attempts': MAX_ATTEMPTS,
+        'questions': [_question_payload(q) for q in questions]
+    })
+
+@app.route('/api/submit_attempt', methods=['POST'])
+def api_submit_attempt():
+    """Grade every remaining answer of the current attempt and record it in one request.
+    
+    Accepts {"answers": {"<question_number>": <answer>, ...}} or
+    {"answers": [{"question_number": n, "answer": <answer>}, ...]}, where an answer is an
+    option index, a list of indices for multi-select questions, or the answer text.
+    """
+    if 'current_quiz' not in session:
+        return jsonify({'error': 'No attempt in progress'}), 409
+    
+    data = request.get_json(silent=True) or {}
+    raw_answers = data.get('answers')
+    try:
+        if isinstance(raw_answers, dict):
+            answers = {int(k): v for k, v in raw_answers.items()}
+        elif isinstance(raw_answers, list):
+            answers = {int(a['question_number']): a.get('answer') for a in raw_answers}
+        else:
+            raise ValueError
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return jsonify({'error': 'answers must be a mapping or a list of {question_number, answer}'}), 400
+    
+    quiz_id = session.get('current_quiz_id', 'quiz1')
+    # Claimed before anything is recorded, so a replayed attempt leaves no trace
+    attempt = _claim_finish(quiz_id)
+    if attempt is None:
+        _clear_attempt()
+        return jsonify({'error': 'Attempt already finished, expired, or attempt limit reached'}), 409
+    _ensure_quiz_session(quiz_id)
+    # Questions already answered through /submit_answer keep their grades
+    remaining = session['current_quiz'][session.get('current_question', 0):]
+    graded = quiz_manager.grade_answers(quiz_id, [(n, answers.get(n)) for n in remaining])
+    
+    # Build all updates first, then apply them together
+    now = datetime.now()
+    for q, answer, is_correct in graded:
+        _record_answer(quiz_id, q, answer, is_correct, now.isoformat())
+    new_wrong = [_wrong_answer_record(q, answer, quiz_id, now.timestamp())
+                 for q, answer, is_correct in graded if not is_correct]
+    session['current_score'] = session.get('current_score', 0) + len(graded) - len(new_wrong)
+    _add_wrong_answers(quiz_id, new_wrong)
+    session['current_question'] = len(session['current_quiz'])
+    quiz_record, _ = _finish_attempt(quiz_id, attempt)
+    
+    return jsonify({
+        'quiz_id': quiz_id,
+        'attempt': quiz_record['attempt'],
+        'max_attempts': MAX_ATTEMPTS,
+        'score': quiz_record['score'],
+        'total': quiz_record['total'],
+        'percentage': quiz_record['percentage'],
+        'results': [{'question_number': q.question_number,
+                     'correct': is_correct,
+                     'correct_answer': q.correct_answer} for q, _, is_correct in graded]
+    })
+
 # Add a route to check quiz loading status
+
 @app.route('/debug')
 def debug():
     if quiz_manager:
-        return jsonify({
+        return conditional_json({
             'base_path': str(quiz_manager.base_path),
             'base_path_exists': quiz_manager.base_path.exists(),
+            'discovered_quizzes': list(quiz_manager.banks),
             'loaded_quizzes': list(quiz_manager.quizzes.keys()),
-            'quiz_details': {k: {'title': v['title'], 'questions_count': len(v['questions'])} 
-                           for k, v in quiz_manager.quizzes.items()}
-        })
+            'quiz_details': {k: {'title': v['title'], 'questions_count': len(v['questions']), 'format': v['format']} 
+                           for k, v in quiz_manager.quizzes.items()},
+            'bank_version': quiz_manager.version,
+            'reload_interval': quiz_manager.reload_interval,
+            'reload_status': quiz_manager.reload_status,
+            'startup': dict(STARTUP, background_load=quiz_manager.background_load_seconds)
+        }, last_modified=quiz_manager.last_modified, private=False)
     else:
         return jsonify({'error': 'QuizManager not initialized'})
 
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: every discovered bank was loaded or failed to load (503 until then)"""
+    if not quiz_manager:
+        return jsonify({'complete': False, 'error': 'QuizManager not initialized'}), 503
+    progress = quiz_manager.load_progress()
+    return jsonify(progress), 200 if progress['complete'] else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return app.response_class(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+def resolve_image_request(filename, accept_mimetypes, version):
+    """(images dir, file to send, immutable?, varies by Accept?) for an image request; shared with asgi.py.
+    
+    The file to send is None for files missing from the image index. May stat the file.
+    """
+    if quiz_manager and not quiz_manager.images.exists(filename):
+        return quiz_manager.images.images_dir, None, False, False
+    info = quiz_manager.images.get(filename) if quiz_manager else None
+    images_dir = quiz_manager.images.images_dir if quiz_manager else Path(__file__).parent / 'source_challenges' / 'images'
+    
+    # Prefer the pre-generated WebP variant for clients that explicitly accept it
+    send_name = filename
+    if info is not None and info.webp and any(mt == 'image/webp' for mt in accept_mimetypes.values()):
+        send_name = info.webp
+    # Hashed URLs change whenever the content does, so they can be cached forever; but only once
+    # the digest is known to match the file (a rewrite is re-hashed by the next reload poll)
+    immutable = info is not None and version == info.digest and quiz_manager.images.is_current(info)
+    return images_dir, send_name, immutable, info is not None and bool(info.webp)
+
 @app.route('/quiz_images/<path:filename>')
 def quiz_images(filename):
     """Serve images from the source_challenges/images directory"""
-    images_dir = Path(__file__).parent / 'source_challenges' / 'images'
-    return send_from_directory(images_dir, filename)
+    images_dir, send_name, immutable, vary_accept = resolve_image_request(
+        filename, request.accept_mimetypes, request.args.get('v'))
+    if send_name is None:
+        abort(404)
+    response = send_from_directory(images_dir, send_name, max_age=31536000 if immutable else 300)
+    response.cache_control.public = True
+    response.cache_control.immutable = immutable or None
+    if vary_accept:
+        response.vary.add('Accept')
+    return response
 
 @app.route('/debug_images')
 def debug_images():
-    """Debug route to check image availability"""
-    # Check both static and source_challenges directories
-    static_dir = Path(app.static_folder) if app.static_folder else Path(__file__).parent / 'static'
-    static_images_dir = static_dir / 'images'
-    source_images_dir = Path(__file__).parent / 'source_challenges' / 'images'
-    
+    """Debug route to check image availability, answered from the image indexes"""
+    static_images.refresh()
     image_info = {
-        'static_images_dir': str(static_images_dir),
-        'static_images_exists': static_images_dir.exists(),
-        'source_images_dir': str(source_images_dir),
-        'source_images_exists': source_images_dir.exists(),
-        'static_images': [],
-        'source_images': []
+        'static_images_dir': str(static_images.images_dir),
+        'static_images_exists': static_images.images_dir.exists(),
+        'static_images': [{'filename': image['filename'], 'path': f"images/{image['filename']}", 'size': image['size']}
+                          for image in static_images.report()['images']],
     }
-    
-    # Check static images
-    if static_images_dir.exists():
-        for img_file in static_images_dir.glob('*'):
-            if img_file.is_file() and img_file.suffix.lower() in ['.jpg', '.jpeg', '.png', '.gif']:
-                image_info['static_images'].append({
-                    'filename': img_file.name,
-                    'path': f'images/{img_file.name}',
-                    'size': img_file.stat().st_size
-                })
-    
-    # Check source images
-    if source_images_dir.exists():
-        for img_file in source_images_dir.glob('*'):
-            if img_file.is_file() and img_file.suffix.lower() in ['.jpg', '.jpeg', '.png', '.gif']:
-                image_info['source_images'].append({
-                    'filename': img_file.name,
-                    'path': f'quiz_images/{img_file.name}',
-                    'size': img_file.stat().st_size
-                })
-    
-    # Check which quiz questions need images
-    image_questions = []
     if quiz_manager:
-        for quiz_id, quiz_data in quiz_manager.quizzes.items():
-            for q in quiz_data['questions']:
-                if q.get('has_image', False):
-                    # Fix the image path
-                    image_src = q.get('image_src', '')
-                    if image_src:
-                        # Convert backslashes to forward slashes and remove 'images\' prefix
-                        clean_filename = image_src.replace('\\', '/').replace('images/', '').replace('images\\', '')
-                        image_questions.append({
-                            'quiz_id': quiz_id,
-                            'question_number': q['question_number'],
-                            'original_image_src': image_src,
-                            'clean_filename': clean_filename,
-                            'new_url': f'/quiz_images/{clean_filename}',
-                            'image_alt': q.get('image_alt', 'No alt text')
-                        })
-    
-    image_info['questions_with_images'] = image_questions
-    
-    return jsonify(image_info)
+        quiz_manager.load_all_quizzes()  # a no-op once every bank is loaded
+        report = quiz_manager.images.report()
+        image_info.update({
+            'source_images_dir': str(quiz_manager.images.images_dir),
+            'source_images_exists': quiz_manager.images.images_dir.exists(),
+            'source_images': [dict(image, path=f"quiz_images/{image['filename']}") for image in report['images']],
+            'questions_with_images': report['questions_with_images'],
+            'missing_images': report['missing_images'],
+            'unreferenced_images': report['unreferenced_images'],
+        })
+    return conditional_json(image_info)
+
+_startup_phase('routes')
+
+def create_app(background_load=True):
+    """App factory for servers that start workers on demand, e.g. gunicorn 'app:create_app()'.
+    
+    Returns at once. With background_load the banks load on a daemon thread: /healthz answers
+    immediately, /readyz turns 200 once every bank is loaded, and requests for a bank that is
+    not loaded yet load it themselves.
+    """
+    if quiz_manager and background_load:
+        quiz_manager.load_in_background()
+    return app
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,137 @@
+"""ASGI entry point (requires asgiref, plus an ASGI server such as uvicorn):
+
+    uvicorn asgi:application --workers 4
+
+Connections are held by the event loop. An exam-taker who is reading a
+question or has a keep-alive connection open uses no thread. Image requests
+are answered natively: the file is stat-ed and streamed in chunks off the
+loop. Every other route runs the Flask app through asgiref's WSGI adapter on
+a bounded thread pool (QUIZ_ASGI_THREADS), so a thread is only used while a
+request is actually being handled. That includes the quiz pages, the JSON and
+stats APIs and their SQLite reads and writes.
+
+Sessions default to the sqlite backend, because the in-memory one does not
+work across worker processes.
+"""
+import asyncio
+import mimetypes
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+from werkzeug.security import safe_join
+
+# The in-memory session store is per process, and uvicorn --workers runs several processes;
+# like gunicorn.conf.py, default to a store the workers share
+os.environ.setdefault('QUIZ_SESSION_BACKEND', 'sqlite')
+
+from app import analytics, app, quiz_manager, resolve_image_request  # noqa: E402
+
+try:
+    from asgiref.sync import sync_to_async
+    from asgiref.wsgi import WsgiToAsgiInstance
+except ImportError as e:  # optional dependency, only needed for ASGI serving
+    raise ImportError("asgi.py needs asgiref: pip install asgiref uvicorn") from e
+
+IMAGE_PREFIX = '/quiz_images/'
+CHUNK_SIZE = 64 * 1024
+ASGI_THREADS = int(os.environ.get('QUIZ_ASGI_THREADS', '32'))
+
+
+class _WsgiInstance(WsgiToAsgiInstance):
+    # asgiref runs WSGI apps thread-sensitively, i.e. all requests on one shared thread;
+    # the Flask app is thread-safe, so use the (bounded) default executor instead
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False)
+
+
+async def wsgi_application(scope, receive, send):
+    await _WsgiInstance(app)(scope, receive, send)
+
+
+def _header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+
+async def _send_simple(send, status, body=b'', headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-length', str(len(body)).encode())] + list(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _read_chunk(f):
+    return f.read(CHUNK_SIZE)
+
+
+async def serve_image(scope, send, filename):
+    """Async counterpart of app.quiz_images, with the same variant and caching rules"""
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    accept = parse_accept_header(_header(scope, b'accept'), MIMEAccept)
+    images_dir, send_name, immutable, vary_accept = await asyncio.to_thread(
+        resolve_image_request, filename, accept, (query.get('v') or [None])[0])
+
+    path = safe_join(str(images_dir), send_name) if send_name else None
+    try:
+        st = await asyncio.to_thread(os.stat, path) if path else None
+    except OSError:
+        st = None
+    if st is None or not os.path.isfile(path):
+        await _send_simple(send, 404, b'Not Found', [(b'content-type', b'text/plain')])
+        return
+
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    cache_control = f"public, max-age={31536000 if immutable else 300}" + (', immutable' if immutable else '')
+    headers = [(b'etag', etag.encode()), (b'cache-control', cache_control.encode())]
+    if vary_accept:
+        headers.append((b'vary', b'Accept'))
+    if etag in _header(scope, b'if-none-match'):
+        await _send_simple(send, 304, headers=headers)
+        return
+
+    content_type = mimetypes.guess_type(send_name)[0] or 'application/octet-stream'
+    headers += [(b'content-type', content_type.encode()), (b'content-length', str(st.st_size).encode())]
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+    if scope['method'] == 'HEAD':
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        while True:
+            chunk = await asyncio.to_thread(_read_chunk, f)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': bool(chunk)})
+            if not chunk:
+                break
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Bounds both the WSGI adapter (it runs requests in the default executor) and file I/O
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='quiz-asgi'))
+            # Serve (and pass health checks) right away; /readyz reports when the banks are in
+            if quiz_manager:
+                quiz_manager.load_in_background()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await asyncio.to_thread(analytics.flush)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    path = scope.get('path', '')
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD') and path.startswith(IMAGE_PREFIX):
+        await serve_image(scope, send, path[len(IMAGE_PREFIX):])
+        return
+    await wsgi_application(scope, receive, send)
@@ -0,0 +1,379 @@
+"""End-to-end benchmark of the quiz flow.
+
+Each simulated user repeatedly runs /start_quiz -> (/quiz -> /submit_answer)*
+-> /quiz_result against synthetic banks, either in-process through the
+Flask test client or over HTTP against a local pre-forked multi-worker
+server. The report covers throughput, p50/p99 latency per route, session
+cookie size and RSS per worker. Every run is saved under
+benchmarks/results/ and can be checked against an earlier run:
+
+    python benchmarks/quiz_flow.py --mode client --questions 500
+    python benchmarks/quiz_flow.py --mode server --workers 4 --concurrency 16
+    python benchmarks/quiz_flow.py --mode server --compare benchmarks/results/<baseline>.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.client import HTTPConnection
+from http.cookies import SimpleCookie
+from pathlib import Path
+from urllib.parse import urlencode
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+OPTION_LABELS = 'ABCD'
+
+
+def make_synthetic_banks(directory, banks=3, questions=200, image_every=0, seed=0):
+    """Write quiz<N>_questions.json files in the format QuizManager loads"""
+    rng = random.Random(seed)
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for b in range(1, banks + 1):
+        items = []
+        for n in range(1, questions + 1):
+            answer = rng.randrange(len(OPTION_LABELS))
+            item = {
+                'question_number': n,
+                'question_text': f'合成题库 {b} 第 {n} 题：' + '软件测试题干内容。' * rng.randint(2, 12),
+                'options': [f'{label}. 选项 {i + 1}' for i, label in enumerate(OPTION_LABELS)],
+                'correct_answer': f'选项 {answer + 1}',
+                'has_image': bool(image_every) and n % image_every == 0,
+            }
+            if item['has_image']:
+                item['image_src'] = f'images\\synthetic_{b}_{n}.png'
+                item['image_alt'] = ''
+            items.append(item)
+        bank = {'title': f'Synthetic bank {b}', 'total_questions': len(items), 'questions': items}
+        with open(directory / f'quiz{b}_questions.json', 'w', encoding='utf-8') as f:
+            json.dump(bank, f, ensure_ascii=False)
+    return directory
+
+
+def configure_env(bank_dir, work_dir, session_backend):
+    """Point app.py at the synthetic banks and throwaway databases (read at import)"""
+    os.environ['QUIZ_BANK_DIR'] = str(bank_dir)
+    os.environ['QUIZ_ANALYTICS_DB'] = str(Path(work_dir) / 'analytics.sqlite3')
+    os.environ['QUIZ_SESSION_BACKEND'] = session_backend
+    os.environ['QUIZ_SESSION_SQLITE_PATH'] = str(Path(work_dir) / 'sessions.sqlite3')
+    os.environ['QUIZ_STATE_SQLITE_PATH'] = str(Path(work_dir) / 'state.sqlite3')
+    os.environ['QUIZ_TEMPLATE_CACHE_DIR'] = str(Path(work_dir) / 'jinja_cache')
+    os.environ['QUIZ_RELOAD_INTERVAL'] = '0'
+
+
+def rss_kb(pid='self'):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if pid == 'self':
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None
+
+
+class TestClientUser:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.close()
+        return response.status_code
+
+    def cookie_size(self):
+        cookie = self.client.get_cookie('session')
+        return len(cookie.value) if cookie else 0
+
+
+class HTTPUser:
+    """Keep-alive HTTP client with a minimal cookie jar"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.conn = HTTPConnection(host, port, timeout=30)
+        self.cookies = {}
+
+    def request(self, method, path, data=None):
+        headers = {}
+        body = None
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for retry in (True, False):
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                response.read()
+                break
+            except (ConnectionError, OSError):
+                self.conn.close()
+                self.conn = HTTPConnection(self.host, self.port, timeout=30)
+                if not retry:
+                    raise
+        for header in response.headers.get_all('Set-Cookie') or ():
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        if response.will_close:
+            self.conn.close()
+        return response.status
+
+    def cookie_size(self):
+        return len(self.cookies.get('session', ''))
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.cookie_sizes = []
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def timed(self, user, method, path, data=None):
+        start = time.perf_counter()
+        try:
+            status = user.request(method, path, data)
+        except OSError:
+            status = None
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies.setdefault(f'{method} {path}', []).append(elapsed)
+            if status is None or status >= 400:
+                self.errors += 1
+            else:
+                self.cookie_sizes.append(user.cookie_size())
+        return status
+
+
+def run_attempt(user, recorder, rng):
+    """One full attempt; /quiz redirects (302) once every question is answered"""
+    recorder.timed(user, 'GET', '/start_quiz')
+    for _ in range(1000):
+        if recorder.timed(user, 'GET', '/quiz') != 200:
+            break
+        choice = str(rng.randrange(len(OPTION_LABELS)))
+        recorder.timed(user, 'POST', '/submit_answer', {'choice': choice})
+    recorder.timed(user, 'GET', '/quiz_result')
+
+
+def run_users(make_user, recorder, users, attempts, concurrency, seed=0):
+    def one_user(i):
+        rng = random.Random(seed + i)
+        user = make_user()
+        for _ in range(attempts):
+            run_attempt(user, recorder, rng)
+
+    if concurrency <= 1:
+        for i in range(users):
+            one_user(i)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one_user, range(users)))
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(recorder, elapsed, flows):
+    routes = {}
+    all_latencies = []
+    for route, values in sorted(recorder.latencies.items()):
+        values.sort()
+        all_latencies.extend(values)
+        routes[route] = {
+            'count': len(values),
+            'p50_ms': round(percentile(values, 50) * 1000, 3),
+            'p99_ms': round(percentile(values, 99) * 1000, 3),
+        }
+    all_latencies.sort()
+    sizes = recorder.cookie_sizes
+    return {
+        'requests': len(all_latencies),
+        'errors': recorder.errors,
+        'elapsed_s': round(elapsed, 3),
+        'requests_per_s': round(len(all_latencies) / elapsed, 1) if elapsed else None,
+        'attempts_per_s': round(flows / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(all_latencies, 50) * 1000, 3) if all_latencies else None,
+        'p99_ms': round(percentile(all_latencies, 99) * 1000, 3) if all_latencies else None,
+        'cookie_bytes_max': max(sizes) if sizes else 0,
+        'cookie_bytes_mean': round(sum(sizes) / len(sizes), 1) if sizes else 0,
+        'routes': routes,
+    }
+
+
+def bench_client(args):
+    """In-process run through the Flask test client (measures app + framework overhead)"""
+    sys.path.insert(0, str(ROOT))
+    from app import app, analytics
+
+    rss_before = rss_kb()
+    run_users(lambda: TestClientUser(app), Recorder(), 1, 1, 1)  # warm-up: loads banks, templates
+    recorder = Recorder()
+    start = time.perf_counter()
+    run_users(lambda: TestClientUser(app), recorder, args.users, args.attempts, args.concurrency, args.seed)
+    elapsed = time.perf_counter() - start
+    analytics.flush()
+    summary = summarize(recorder, elapsed, args.users * args.attempts)
+    summary['rss_kb'] = {'process': rss_kb(), 'before_run': rss_before}
+    return summary
+
+
+def _serve(fd, threaded):
+    sys.path.insert(0, str(ROOT))
+    import logging
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no per-request access log
+    from werkzeug.serving import make_server
+    from app import app
+    make_server('127.0.0.1', 0, app, threaded=threaded, fd=fd).serve_forever()
+
+
+def bench_server(args):
+    """HTTP run against N pre-forked worker processes sharing one listening socket"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('127.0.0.1', args.port))
+    sock.listen(1024)
+    port = sock.getsockname()[1]
+    ctx = multiprocessing.get_context('fork')
+    workers = [ctx.Process(target=_serve, args=(sock.fileno(), args.threads), daemon=True)
+               for _ in range(args.workers)]
+    for w in workers:
+        w.start()
+    try:
+        # Warm every worker (bank loading, template compilation) before timing
+        run_users(lambda: HTTPUser('127.0.0.1', port), Recorder(), args.workers * 2, 1,
+                  args.workers * 2)
+        recorder = Recorder()
+        start = time.perf_counter()
+        run_users(lambda: HTTPUser('127.0.0.1', port), recorder, args.users, args.attempts,
+                  args.concurrency, args.seed)
+        elapsed = time.perf_counter() - start
+        summary = summarize(recorder, elapsed, args.users * args.attempts)
+        summary['rss_kb'] = {str(w.pid): rss_kb(w.pid) for w in workers}
+    finally:
+        for w in workers:
+            w.terminate()
+        for w in workers:
+            w.join(5)
+        sock.close()
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# (metric, True when higher is better)
+COMPARED_METRICS = [('requests_per_s', True), ('p50_ms', False), ('p99_ms', False),
+                    ('cookie_bytes_max', False)]
+
+
+def compare(baseline, current, tolerance):
+    """Print metric deltas; return the metrics that regressed by more than tolerance (a fraction)"""
+    regressions = []
+    for metric, higher_is_better in COMPARED_METRICS:
+        old, new = baseline['summary'].get(metric), current['summary'].get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = '  REGRESSION' if worse > tolerance else ''
+        print(f"{metric:>18}: {old:>10} -> {new:>10} ({change:+.1%}){flag}")
+        if flag:
+            regressions.append(metric)
+    return regressions
+
+
+def print_summary(summary):
+    print(f"{summary['requests']} requests in {summary['elapsed_s']}s, {summary['errors']} errors")
+    print(f"throughput: {summary['requests_per_s']} req/s, {summary['attempts_per_s']} attempts/s")
+    print(f"latency: p50 {summary['p50_ms']} ms, p99 {summary['p99_ms']} ms")
+    for route, stats in summary['routes'].items():
+        print(f"  {route:<22} n={stats['count']:<7} p50 {stats['p50_ms']:>8} ms  p99 {stats['p99_ms']:>8} ms")
+    print(f"session cookie: max {summary['cookie_bytes_max']} B, mean {summary['cookie_bytes_mean']} B")
+    print(f"RSS (KiB): {summary['rss_kb']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the quiz flow end to end')
+    parser.add_argument('--mode', choices=('client', 'server'), default='client')
+    parser.add_argument('--banks', type=int, default=3, help='number of synthetic banks')
+    parser.add_argument('--questions', type=int, default=200, help='questions per synthetic bank')
+    parser.add_argument('--image-every', type=int, default=0, help='give every Nth question an image')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--attempts', type=int, default=5, help='attempts per user (the app allows 5)')
+    parser.add_argument('--concurrency', type=int, default=1, help='client threads')
+    parser.add_argument('--workers', type=int, default=2, help='server worker processes (server mode)')
+    parser.add_argument('--no-threads', dest='threads', action='store_false',
+                        help='single-threaded workers (server mode)')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--session-backend', choices=('memory', 'sqlite', 'cookie'), default='memory')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='result file (default: benchmarks/results/<mode>-<time>.json)')
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed relative regression before failing (default 0.10)')
+    args = parser.parse_args(argv)
+    if args.mode == 'server' and args.session_backend == 'memory' and args.workers > 1:
+        parser.error('the memory session backend is per process; use --session-backend sqlite or cookie')
+
+    with tempfile.TemporaryDirectory(prefix='quiz-bench-') as work_dir:
+        bank_dir = make_synthetic_banks(Path(work_dir) / 'banks', args.banks, args.questions,
+                                        args.image_every, args.seed)
+        configure_env(bank_dir, work_dir, args.session_backend)
+        summary = bench_client(args) if args.mode == 'client' else bench_server(args)
+
+    params = {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'tolerance')}
+    result = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': sys.version.split()[0],
+        'cpu_count': os.cpu_count(),
+        'params': params,
+        'summary': summary,
+    }
+    print_summary(summary)
+
+    output = Path(args.output) if args.output else \
+        RESULTS_DIR / f"{args.mode}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+    print(f"Wrote {output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            print("warning: baseline was run with different parameters")
+        if compare(baseline, result, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,122 @@
+"""Cold-start profile of the app.
+
+Runs fresh interpreters and reports:
+
+- where import time goes (python -X importtime), by module and by top-level package;
+- the app's own startup phases (app.STARTUP);
+- how long until /healthz answers and until /readyz reports every bank loaded,
+  using create_app() with background loading;
+- the load time of each bank.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --top 30 --bank-dir /path/to/banks
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+COLD_START = r'''
+import json, sys, time
+started = time.perf_counter()
+import app as quiz_app
+imported = time.perf_counter()
+client = quiz_app.create_app().test_client()
+healthz = client.get('/healthz').status_code
+healthy = time.perf_counter()
+while client.get('/readyz').status_code != 200:
+    if time.perf_counter() - started > 120:
+        break
+    time.sleep(0.002)
+ready = time.perf_counter()
+manager = quiz_app.quiz_manager
+print(json.dumps({
+    'import_s': imported - started,
+    'healthz_s': healthy - started,
+    'healthz_status': healthz,
+    'ready_s': ready - started,
+    'phases': dict(quiz_app.STARTUP, background_load=manager.background_load_seconds),
+    'banks': {quiz_id: status.get('load_ms') for quiz_id, status in manager.reload_status['banks'].items()},
+}))
+'''
+
+
+def _env(bank_dir, instance_dir):
+    env = dict(os.environ)
+    # Keep the profile's databases out of the real instance folder
+    env.setdefault('QUIZ_ANALYTICS_DB', str(Path(instance_dir) / 'analytics.sqlite3'))
+    env.setdefault('QUIZ_STATE_SQLITE_PATH', str(Path(instance_dir) / 'state.sqlite3'))
+    env.setdefault('QUIZ_RELOAD_INTERVAL', '0')
+    if bank_dir:
+        env['QUIZ_BANK_DIR'] = str(bank_dir)
+    return env
+
+
+def import_times(env):
+    """[(module, self_us, cumulative_us)] for `import app`, in import order"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+    return modules
+
+
+def cold_start(env):
+    result = subprocess.run([sys.executable, '-c', COLD_START], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Profile app import and cold start')
+    parser.add_argument('--top', type=int, default=15, help='Modules to list by self time')
+    parser.add_argument('--bank-dir', help='Bank directory (default: the app default)')
+    parser.add_argument('--json', help='Also write the raw results to this file')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as instance_dir:
+        env = _env(args.bank_dir, instance_dir)
+        modules = import_times(env)
+        start = cold_start(env)
+
+    total_us = next((cumulative for name, _, cumulative in reversed(modules) if name == 'app'), 0)
+    print(f"import app: {total_us / 1000:.1f} ms")
+    print(f"\nTop {args.top} modules by self time:")
+    for name, self_us, cumulative_us in sorted(modules, key=lambda m: -m[1])[:args.top]:
+        print(f"  {self_us / 1000:8.2f} ms  (cumulative {cumulative_us / 1000:8.2f} ms)  {name}")
+    packages = {}
+    for name, self_us, _ in modules:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+    print("\nBy top-level package (self time):")
+    for package, self_us in sorted(packages.items(), key=lambda p: -p[1])[:args.top]:
+        print(f"  {self_us / 1000:8.2f} ms  {package}")
+
+    print("\nApp startup phases:")
+    for phase, seconds in start['phases'].items():
+        print(f"  {seconds * 1000:8.2f} ms  {phase}")
+    print("\nCold start (create_app with background loading):")
+    print(f"  import            {start['import_s'] * 1000:8.2f} ms")
+    print(f"  /healthz answered {start['healthz_s'] * 1000:8.2f} ms (status {start['healthz_status']})")
+    print(f"  /readyz ready     {start['ready_s'] * 1000:8.2f} ms")
+    print("\nBank load times:")
+    for quiz_id, load_ms in start['banks'].items():
+        print(f"  {load_ms if load_ms is not None else float('nan'):8.2f} ms  {quiz_id}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'imports': modules, 'cold_start': start}, f, indent=2)
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == '__main__':
+    main()
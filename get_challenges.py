@@ -1,131 +1,485 @@
+import argparse
+import hashlib
 import json
+import os
 import re
-from bs4 import BeautifulSoup
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-def parse_quiz_html(html_file_path, output_json_path):
+from bs4 import BeautifulSoup, SoupStrainer
+
+from helpers import natural_key
+
+try:
+    import lxml  # noqa: F401  可选依赖，安装后解析更快
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
+
+QUESTION_NUMBER_RE = re.compile(r'试题 (\d+)')
+# 每道题从 <h3>试题 N</h3> 开始，到下一道题的 <h3> 为止
+QUESTION_START_RE = re.compile(r'<h3\b[^>]*>\s*试题')
+DIV_TAG_RE = re.compile(r'</?div\b[^>]*>', re.IGNORECASE)
+OPTION_LABEL_RE = re.compile(r'^[A-Z][.．、]\s*')
+
+# 页面标题只在第一道题之前的部分查找
+ONLY_TITLE = SoupStrainer('h1')
+
+CACHE_NAME = '.ingest_cache.json'
+# 解析结果格式变化时递增（2：题干包含多段）
+CACHE_VERSION = 2
+MANIFEST_NAME = 'banks.json'
+BANK_FILE_RE = re.compile(r'^(?P<bank_id>.+)_questions\.json$')
+# 新文件与已有题库文件相同题目的比例达到此值时，沿用该题库ID
+MATCH_THRESHOLD = 0.5
+
+
+def sha256_hex(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse_question_div(div):
+    """解析单个题目div，不是题目时返回None"""
+    # 查找题目标题
+    h3 = div.find('h3')
+    if not h3 or not h3.text.startswith('试题'):
+        return None
+
+    question_data = {}
+
+    # 提取题目编号
+    question_number = QUESTION_NUMBER_RE.search(h3.text)
+    if question_number:
+        question_data['question_number'] = int(question_number.group(1))
+
+    # 提取题目内容：题干可能有多段（如选项所引用的编号列表），
+    # 多段时与已有题库一致，用换行连接并保留结尾的“选择一项：”
+    paragraphs = div.find_all('p')
+    stem = []
+    for p in paragraphs:
+        text = p.get_text(strip=True).replace('\xa0', ' ')
+        if '正确答案是：' in text:
+            break
+        if text:
+            stem.append(text)
+        if '选择一项：' in text:
+            break
+    if len(stem) == 2 and stem[-1] == '选择一项：':
+        stem.pop()
+    question_data['question_text'] = '\n'.join(stem) if stem != ['选择一项：'] else ''
+
+    # 提取选项
+    options = []
+    ul = div.find('ul')
+    if ul:
+        for li in ul.find_all('li'):
+            option_text = li.get_text(strip=True)
+            if option_text:  # 确保选项不为空
+                options.append(option_text)
+    question_data['options'] = options
+
+    # 提取正确答案
+    correct_answer = ""
+    for p in paragraphs:
+        if '正确答案是：' in p.text:
+            correct_answer = p.text.replace('正确答案是：', '').strip()
+            break
+    question_data['correct_answer'] = correct_answer
+
+    # 检查是否包含图片
+    img = div.find('img')
+    if img:
+        question_data['has_image'] = True
+        question_data['image_src'] = img.get('src', '')
+        question_data['image_alt'] = img.get('alt', '')
+    else:
+        question_data['has_image'] = False
+
+    return question_data
+
+
+def split_question_blocks(html_content):
     """
-    解析HTML文件中的测试题目并保存到JSON文件
-    
+    把HTML按题目切分成原始文本块
+
+    Returns:
+        (题目之前的页面头部, [题目块, ...])
+    """
+    starts = [m.start() for m in QUESTION_START_RE.finditer(html_content)]
+    if not starts:
+        return html_content, []
+    ends = starts[1:] + [len(html_content)]
+    return html_content[:starts[0]], [html_content[a:b] for a, b in zip(starts, ends)]
+
+
+def parse_question_block(block):
+    """解析单个题目块（块边界上残留的div标签会先去掉）"""
+    soup = BeautifulSoup('<div>' + DIV_TAG_RE.sub('', block) + '</div>', PARSER)
+    question_data = parse_question_div(soup.find('div'))
+    # 只保留有效的题目（至少包含题目文本）
+    if question_data and question_data.get('question_text'):
+        return question_data
+    return None
+
+
+def parse_title(head):
+    h1 = BeautifulSoup(head, PARSER, parse_only=ONLY_TITLE).find('h1')
+    return h1.get_text(strip=True) if h1 else None
+
+
+def parse_source(html_file_path, known_sha=None, known_blocks=()):
+    """
+    解析一个HTML导出文件，跳过缓存中已有的内容（在工作进程中运行）
+
     Args:
         html_file_path: HTML文件路径
-        output_json_path: 输出JSON文件路径
+        known_sha: 上次解析时文件的sha256
+        known_blocks: 上次解析时各题目块的sha256
+
+    Returns:
+        文件未变化时 {'sha256', 'unchanged': True}；
+        否则 {'sha256', 'title', 'blocks': [(块sha256, 题目或None), ...]}，
+        其中已知的块不重新解析，题目为None
     """
-    
-    # 读取HTML文件
-    with open(html_file_path, 'r', encoding='utf-8') as file:
-        html_content = file.read()
-    
-    # 使用BeautifulSoup解析HTML
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    # 查找所有题目div
-    question_divs = soup.find_all('div')
-    
-    questions = []
-    
-    for div in question_divs:
-        # 查找题目标题
-        h3 = div.find('h3')
-        if not h3 or not h3.text.startswith('试题'):
-            continue
-            
-        question_data = {}
-        
-        # 提取题目编号
-        question_number = re.search(r'试题 (\d+)', h3.text)
-        if question_number:
-            question_data['question_number'] = int(question_number.group(1))
-        
-        # 提取题目内容
-        question_text = ""
-        paragraphs = div.find_all('p')
-        
-        for i, p in enumerate(paragraphs):
-            if '选择一项：' in p.text:
-                break
-            if '正确答案是：' in p.text:
-                break
-            if i == 0:  # 第一个p标签通常是题目描述
-                question_text = p.get_text(strip=True)
-                break
-        
-        question_data['question_text'] = question_text
-        
-        # 提取选项
-        options = []
-        ul = div.find('ul')
-        if ul:
-            li_elements = ul.find_all('li')
-            for li in li_elements:
-                option_text = li.get_text(strip=True)
-                if option_text:  # 确保选项不为空
-                    options.append(option_text)
-        
-        question_data['options'] = options
-        
-        # 提取正确答案
-        correct_answer = ""
-        for p in paragraphs:
-            if '正确答案是：' in p.text:
-                correct_answer = p.text.replace('正确答案是：', '').strip()
-                break
-        
-        question_data['correct_answer'] = correct_answer
-        
-        # 检查是否包含图片
-        img = div.find('img')
-        if img:
-            question_data['has_image'] = True
-            question_data['image_src'] = img.get('src', '')
-            question_data['image_alt'] = img.get('alt', '')
-        else:
-            question_data['has_image'] = False
-        
-        # 只添加有效的题目（至少包含题目文本）
-        if question_data.get('question_text'):
-            questions.append(question_data)
-    
-    # 保存到JSON文件
-    output_data = {
+    with open(html_file_path, 'rb') as file:
+        raw = file.read()
+    sha = sha256_hex(raw)
+    if sha == known_sha:
+        return {'sha256': sha, 'unchanged': True}
+
+    known_blocks = set(known_blocks)
+    head, blocks = split_question_blocks(raw.decode('utf-8'))
+    parsed = []
+    for block in blocks:
+        block_sha = sha256_hex(block.encode('utf-8'))
+        parsed.append((block_sha, None if block_sha in known_blocks else parse_question_block(block)))
+    return {'sha256': sha, 'title': parse_title(head), 'blocks': parsed}
+
+
+def parse_quiz_file(html_file_path):
+    """
+    解析一个HTML导出文件，返回题库数据（不写文件）
+
+    Args:
+        html_file_path: HTML文件路径
+
+    Returns:
+        {'title', 'total_questions', 'questions'}
+    """
+    result = parse_source(html_file_path)
+    questions = [q for _, q in result['blocks'] if q]
+    return {
+        'title': result['title'],
         'total_questions': len(questions),
         'questions': questions
     }
-    
-    with open(output_json_path, 'w', encoding='utf-8') as json_file:
+
+
+def write_bank(bank, output_json_path):
+    """以QuizManager可加载的格式写出题库（先写临时文件再替换，避免读到半个文件）"""
+    output_json_path = Path(output_json_path)
+    output_json_path.parent.mkdir(parents=True, exist_ok=True)
+    output_data = {'total_questions': bank['total_questions'], 'questions': bank['questions']}
+    if bank.get('title'):
+        output_data = {'title': bank['title'], **output_data}
+    tmp_path = output_json_path.with_name(output_json_path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as json_file:
         json.dump(output_data, json_file, ensure_ascii=False, indent=2)
-    
-    print(f"成功解析 {len(questions)} 道题目，已保存到 {output_json_path}")
-    return output_data
-
-def main():
-    # 定义文件路径
-    html_file = r"C:\Users\Duoyu\Documents\Code\SoftwareTestingChallenge\source_challenges\simpread-测验五：综合应用：答题回顾  砺儒云课堂.html"
-    json_file = r"c:\Users\Duoyu\Documents\Code\SoftwareTestingChallenge\quiz5_questions.json"
-    
-    # 确保输出目录存在
-    Path(json_file).parent.mkdir(parents=True, exist_ok=True)
-    
+    os.replace(tmp_path, output_json_path)
+
+
+def parse_quiz_html(html_file_path, output_json_path):
+    """
+    解析HTML文件中的测试题目并保存到JSON文件
+
+    Args:
+        html_file_path: HTML文件路径
+        output_json_path: 输出JSON文件路径
+    """
+    bank = parse_quiz_file(html_file_path)
+    # 单文件模式保持原有输出格式（不含标题）
+    write_bank(dict(bank, title=None), output_json_path)
+    print(f"成功解析 {bank['total_questions']} 道题目，已保存到 {output_json_path}")
+    return {'total_questions': bank['total_questions'], 'questions': bank['questions']}
+
+
+def collect_html_files(inputs):
+    """展开输入路径：目录下的所有.html文件，或单个文件"""
+    files = []
+    for path in map(Path, inputs):
+        if path.is_dir():
+            files.extend(sorted(path.glob('*.html')))
+        else:
+            files.append(path)
+    return files
+
+
+def _normalize(text):
+    return ''.join(unicodedata.normalize('NFKC', text).split()).casefold()
+
+
+def dedupe_key(question):
+    """按规范化后的题干和选项（忽略选项顺序和A./B.标号）判断重复"""
+    options = sorted(_normalize(OPTION_LABEL_RE.sub('', o)) for o in question.get('options', []))
+    return _normalize(question.get('question_text', '')) + '\x1f' + '\x1e'.join(options)
+
+
+def match_key(question):
+    """与 dedupe_key 相同，但只取题干第一行：旧版解析器输出的题干可能多带或少带代码段"""
+    text = question.get('question_text', '').strip().split('\n')[0]
+    return dedupe_key({'question_text': text, 'options': question.get('options', [])})
+
+
+class IngestCache:
+    """
+    输出目录下的 .ingest_cache.json：
+    sources 记录每个HTML文件的sha256、题库ID和题目块列表，
+    blocks 按块sha256保存已解析的题目
+    """
+
+    def __init__(self, path, data=None):
+        self.path = Path(path)
+        data = data if data and data.get('version') == CACHE_VERSION else {}
+        self.sources = data.get('sources', {})
+        self.blocks = data.get('blocks', {})
+
+    @classmethod
+    def load(cls, output_dir):
+        path = Path(output_dir) / CACHE_NAME
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return cls(path, json.load(f))
+        except (FileNotFoundError, ValueError):
+            return cls(path)
+
+    def next_bank_number(self, prefix, start, taken=()):
+        """下一个未被缓存记录或已有题库文件（taken）占用的编号"""
+        ids = [s['bank_id'] for s in self.sources.values()] + list(taken)
+        numbers = [int(i[len(prefix):]) for i in ids if i.startswith(prefix) and i[len(prefix):].isdigit()]
+        return max(numbers + [start - 1]) + 1
+
+    def save(self):
+        # 只保留仍被引用的题目块
+        referenced = {h for s in self.sources.values() for h in s['blocks']}
+        self.blocks = {h: q for h, q in self.blocks.items() if h in referenced}
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': CACHE_VERSION, 'sources': self.sources, 'blocks': self.blocks},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def existing_banks(output_dir):
+    """输出目录中已有的题库：{题库ID: 题目匹配键集合}"""
+    banks = {}
+    for path in sorted(Path(output_dir).glob('*_questions.json')):
+        match = BANK_FILE_RE.match(path.name)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                questions = json.load(f).get('questions', [])
+        except (OSError, ValueError, AttributeError):
+            questions = []
+        banks[match.group('bank_id')] = {match_key(q) for q in questions}
+    return banks
+
+
+def match_existing_bank(questions, banks, claimed):
+    """与新文件题目重合最多（且达到 MATCH_THRESHOLD）的未占用已有题库ID，没有则返回None"""
+    keys = {match_key(q) for q in questions}
+    best_id, best_score = None, MATCH_THRESHOLD
+    for bank_id, bank_keys in banks.items():
+        if bank_id in claimed or not keys:
+            continue
+        score = len(keys & bank_keys) / len(keys)
+        if score >= best_score:
+            best_id, best_score = bank_id, score
+    return best_id
+
+
+def ingest(html_files, output_dir, prefix='quiz', start=1, workers=None, compile_banks=False,
+           use_cache=True, dedupe=False, bank_ids=None):
+    """
+    并行解析多个HTML导出文件，写出 <prefix>N_questions.json
+
+    未变化的文件直接跳过，变化的文件只重新解析变化的题目块；
+    题库ID按源文件记录在缓存中，新增文件不会改变已有题库的编号。
+    缓存中没有的文件优先使用 bank_ids（{HTML文件名: 题库ID}）指定的ID，
+    其次沿用输出目录中题目与之相同的已有题库的ID，都没有才分配新编号，
+    因此已有题库（及按题库ID记录的会话和统计数据）不会被其他内容覆盖。
+    按内容沿用的已有题库在首次导入时不重写（其中可能有手工整理过的题干），
+    之后该HTML文件有变化时才按解析结果重写。
+    dedupe=True 时按规范化文本去除跨题库（及题库内）的重复题目，保留最先出现的。
+
+    Returns:
+        清单条目列表
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cache = IngestCache.load(output_dir) if use_cache else IngestCache(output_dir / CACHE_NAME)
+    keys = [str(Path(f).resolve()) for f in html_files]
+    known = [cache.sources.get(key, {}) for key in keys]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, len(html_files) // ((workers or os.cpu_count() or 1) * 4))
+        results = list(pool.map(parse_source, html_files,
+                                [k.get('sha256') for k in known],
+                                [k.get('blocks', ()) for k in known],
+                                chunksize=chunksize))
+
+    # 更新缓存中的源文件记录
+    bank_ids = bank_ids or {}
+    banks = None
+    changed = set()
+    adopted = set()
+    for key, html_file, result in zip(keys, html_files, results):
+        explicit_id = bank_ids.get(Path(html_file).name)
+        source = cache.sources.get(key)
+        if source is not None and explicit_id and source['bank_id'] != explicit_id:
+            source.update(bank_id=explicit_id, emitted=[])
+        if result.get('unchanged'):
+            continue
+        if source is None:
+            if banks is None:
+                banks = existing_banks(output_dir)
+            claimed = {s['bank_id'] for s in cache.sources.values()}
+            bank_id = explicit_id or match_existing_bank(
+                [q for _, q in result['blocks'] if q], banks, claimed)
+            if bank_id is not None and not explicit_id:
+                adopted.add(key)
+            if bank_id is None:
+                bank_id = f'{prefix}{cache.next_bank_number(prefix, start, banks)}'
+            source = cache.sources[key] = {'bank_id': bank_id, 'emitted': []}
+        reparsed = 0
+        for block_sha, question in result['blocks']:
+            if question is not None or block_sha not in cache.blocks:
+                cache.blocks[block_sha] = question
+                reparsed += 1
+        source.update(sha256=result['sha256'], title=result['title'],
+                      blocks=[block_sha for block_sha, _ in result['blocks']])
+        changed.add(key)
+        print(f"已更新 {html_file}：重新解析 {reparsed}/{len(result['blocks'])} 个题目块")
+
+    # 组装题库（可选去重），只重写内容有变化的题库
+    entries = []
+    seen = set()
+    for key, html_file in zip(keys, html_files):
+        source = cache.sources[key]
+        emitted = []
+        for block_sha in source['blocks']:
+            question = cache.blocks.get(block_sha)
+            if not question:
+                continue
+            if dedupe:
+                k = dedupe_key(question)
+                if k in seen:
+                    continue
+                seen.add(k)
+            emitted.append(block_sha)
+
+        bank_id = source['bank_id']
+        output_json_path = output_dir / f'{bank_id}_questions.json'
+        questions = [cache.blocks[h] for h in emitted]
+        if not questions:
+            print(f"跳过 {html_file}：没有可写入的题目")
+            continue
+        if key in adopted:
+            source['emitted'] = emitted
+            try:
+                with open(output_json_path, 'r', encoding='utf-8') as f:
+                    questions = json.load(f).get('questions', questions)
+            except (OSError, ValueError, AttributeError):
+                pass
+            print(f"沿用已有题库 {output_json_path}（未重写）：{html_file}")
+        elif key in changed or emitted != source['emitted'] or not output_json_path.exists():
+            write_bank({'title': source['title'], 'total_questions': len(questions), 'questions': questions},
+                       output_json_path)
+            source['emitted'] = emitted
+            print(f"已写入 {len(questions)} 道题目：{html_file} -> {output_json_path}")
+        if compile_banks:
+            from quiz_bank import compile_bank, compiled_path_for, load_compiled_bank
+            compiled = compiled_path_for(output_json_path)
+            if not compiled.exists() or load_compiled_bank(compiled, source_path=output_json_path) is None:
+                compile_bank(output_json_path)
+
+        entry = {'id': bank_id, 'file': output_json_path.name,
+                 'total_questions': len(questions), 'source': Path(html_file).name}
+        if source.get('title'):
+            entry['title'] = source['title']
+        entries.append(entry)
+
+    if use_cache:
+        cache.save()
+    skipped = len(html_files) - len(changed)
+    print(f"{len(changed)} 个文件有变化，{skipped} 个未变化已跳过")
+    return entries
+
+
+def write_manifest(entries, output_dir):
+    """
+    合并写出 banks.json：本次导入的条目覆盖同ID的旧条目，
+    原清单中的其他条目和目录中清单未列出的题库文件都保留
+    （QuizManager 有清单时只加载清单中的题库）
+    """
+    output_dir = Path(output_dir)
+    manifest_path = output_dir / MANIFEST_NAME
+    merged = {}
     try:
-        # 解析HTML并保存到JSON
-        result = parse_quiz_html(html_file, json_file)
-        
-        # 打印解析结果概览
-        print(f"\n解析完成！")
-        print(f"总题目数: {result['total_questions']}")
-        
-        # 显示前3题的概览
-        for i, question in enumerate(result['questions'][:3]):
-            print(f"\n题目 {question['question_number']}:")
-            print(f"  内容: {question['question_text'][:50]}...")
-            print(f"  选项数: {len(question['options'])}")
-            print(f"  正确答案: {question['correct_answer']}")
-            print(f"  包含图片: {question['has_image']}")
-            
-    except FileNotFoundError:
-        print(f"错误：找不到HTML文件 {html_file}")
-    except Exception as e:
-        print(f"解析过程中出现错误: {str(e)}")
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            old_entries = json.load(f).get('banks', [])
+    except (FileNotFoundError, ValueError):
+        old_entries = []
+    for entry in old_entries:
+        if (output_dir / entry.get('file', f"{entry['id']}_questions.json")).exists():
+            merged[entry['id']] = entry
+    for path in output_dir.glob('*_questions.json'):
+        bank_id = BANK_FILE_RE.match(path.name).group('bank_id')
+        merged.setdefault(bank_id, {'id': bank_id, 'file': path.name})
+    for entry in entries:
+        merged[entry['id']] = entry
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'banks': [merged[i] for i in sorted(merged, key=natural_key)]}, f, ensure_ascii=False, indent=2)
+    return manifest_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批量将答题回顾HTML导出文件转换为题库')
+    parser.add_argument('inputs', nargs='+', help='HTML文件或包含HTML文件的目录')
+    parser.add_argument('-o', '--output-dir', default='source_challenges', help='题库输出目录')
+    parser.add_argument('--prefix', default='quiz', help='题库ID前缀（默认 quiz，生成 quiz1、quiz2 ...）')
+    parser.add_argument('--start', type=int, default=1, help='起始编号')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='并行进程数（默认CPU核数）')
+    parser.add_argument('--compile', action='store_true', help='同时生成 .qbank 编译题库')
+    parser.add_argument('--no-manifest', action='store_true', help='不写 banks.json 清单')
+    parser.add_argument('--no-cache', action='store_true', help='忽略增量缓存，全部重新解析')
+    parser.add_argument('--dedupe', action='store_true', help='按规范化文本去除跨题库的重复题目')
+    parser.add_argument('--id', action='append', default=[], metavar='HTML文件名=题库ID',
+                        help='为导出文件指定题库ID（可重复）')
+    args = parser.parse_args(argv)
+
+    bank_ids = {}
+    for item in args.id:
+        name, sep, bank_id = item.rpartition('=')
+        if not sep or not name or not bank_id:
+            print(f"错误：--id 格式应为 HTML文件名=题库ID：{item}")
+            return 1
+        bank_ids[Path(name).name] = bank_id
+
+    html_files = collect_html_files(args.inputs)
+    if not html_files:
+        print("错误：没有找到HTML文件")
+        return 1
+
+    entries = ingest(html_files, args.output_dir, prefix=args.prefix, start=args.start,
+                     workers=args.workers, compile_banks=args.compile,
+                     use_cache=not args.no_cache, dedupe=args.dedupe, bank_ids=bank_ids)
+    if not args.no_manifest:
+        print(f"已写入清单 {write_manifest(entries, args.output_dir)}")
+
+    print(f"\n解析完成！共 {len(entries)} 个题库，"
+          f"{sum(e['total_questions'] for e in entries)} 道题目")
+    return 0
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    raise SystemExit(main())
@@ -0,0 +1,124 @@
+"""Answer keys resolved to option indices when a bank loads.
+
+Banks store options as "A. text" and the correct answer as bare text (or,
+for multi-select questions, several texts or letters). resolve_key() turns
+that into a set of option indices once. A submission is normalized the same
+way (an index, a list of indices, or legacy answer text), so grading is a
+comparison of small integer sets. Questions whose answer matches no option
+fall back to comparing text.
+"""
+import re
+
+LABEL_RE = re.compile(r'^([A-Z])[.．、]\s*')
+LETTERS_RE = re.compile(r'^[A-Z](?:\s*[,，、;；\s]?\s*[A-Z])*$')
+SEPARATOR_RE = re.compile(r'\s*[,，、;；]\s*')
+TRUE_WORDS = frozenset(['对', '正确', '是', '√', 'true', 't', 'yes', 'y'])
+FALSE_WORDS = frozenset(['错', '错误', '否', '×', 'false', 'f', 'no', 'n'])
+# Options shown for true/false questions that come without any
+TRUE_FALSE_OPTIONS = ('正确', '错误')
+
+SINGLE = 'single'
+MULTIPLE = 'multiple'
+TRUE_FALSE = 'true_false'
+TEXT = 'text'
+
+
+def option_value(option):
+    """'A. text' -> 'text'"""
+    return LABEL_RE.sub('', option, count=1).strip()
+
+
+def _truth(text):
+    folded = text.strip().casefold()
+    if folded in TRUE_WORDS:
+        return True
+    if folded in FALSE_WORDS:
+        return False
+    return None
+
+
+class AnswerKey:
+    __slots__ = ('kind', 'options', 'indices', 'text', '_by_value')
+
+    def __init__(self, kind, options, indices, text):
+        self.kind = kind
+        self.options = options  # option values (labels stripped), in display order
+        self.indices = indices  # frozenset of correct option indices; empty for TEXT
+        self.text = text  # correct answer as stored, for TEXT grading and display
+        self._by_value = {}
+        for i, value in enumerate(options):
+            self._by_value.setdefault(value, i)
+
+    def lookup(self, text):
+        """Option indices named by answer text (an option, letters like 'A, C', or true/false words)"""
+        text = text.strip()
+        if not text:
+            return None
+        if text in self._by_value:
+            return frozenset([self._by_value[text]])
+        if self.kind == TRUE_FALSE:
+            truth = _truth(text)
+            if truth is not None:
+                return frozenset([self._truth_index(truth)])
+        if LETTERS_RE.match(text):
+            indices = frozenset(ord(c) - ord('A') for c in text if 'A' <= c <= 'Z')
+            if all(i < len(self.options) for i in indices):
+                return indices
+        parts = SEPARATOR_RE.split(text)
+        if len(parts) > 1 and all(p in self._by_value for p in parts):
+            return frozenset(self._by_value[p] for p in parts)
+        return None
+
+    def _truth_index(self, truth):
+        for i, value in enumerate(self.options):
+            if _truth(value) is truth:
+                return i
+        return 0 if truth else 1
+
+    def normalize(self, submission):
+        """frozenset of option indices for an index, a list of indices/texts or answer text; None if invalid"""
+        if isinstance(submission, bool) or submission is None:
+            return None
+        if isinstance(submission, int):
+            return frozenset([submission]) if 0 <= submission < len(self.options) else None
+        if isinstance(submission, (list, tuple)):
+            indices = set()
+            for item in submission:
+                part = self.normalize(item)
+                if part is None:
+                    return None
+                indices |= part
+            return frozenset(indices) or None
+        if isinstance(submission, str):
+            return self.lookup(submission)
+        return None
+
+    def grade(self, submission):
+        if self.kind == TEXT:
+            return isinstance(submission, str) and submission.strip() == self.text
+        return self.normalize(submission) == self.indices
+
+    def answer_text(self, indices):
+        """Readable form of normalized indices: the option text, or letters for several options"""
+        if len(indices) == 1:
+            return self.options[next(iter(indices))]
+        return ', '.join(chr(ord('A') + i) for i in sorted(indices))
+
+
+def resolve_key(question):
+    """AnswerKey for a quiz_bank.Question"""
+    options = tuple(option_value(o) for o in question.options)
+    text = question.answer_key
+    if not options and _truth(text) is not None:
+        options = TRUE_FALSE_OPTIONS
+    key = AnswerKey(TEXT, options, frozenset(), text)
+    if len(options) == 2 and all(_truth(o) is not None for o in options) or options is TRUE_FALSE_OPTIONS:
+        key.kind = TRUE_FALSE
+    indices = key.lookup(text)
+    if indices is None:
+        key.kind = TEXT
+    else:
+        key.indices = indices
+        if key.kind != TRUE_FALSE:
+            key.kind = SINGLE if len(indices) == 1 else MULTIPLE
+    return key
@@ -0,0 +1,37 @@
+"""gunicorn settings for wsgi.py; every value can be overridden from the environment.
+
+Banks are loaded in the master (preload_app). The objects that exist at fork
+time are then moved out of the garbage collector's reach with gc.freeze(),
+so collections in the workers do not write to, and thereby un-share, the
+preloaded pages.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get('QUIZ_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('QUIZ_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('QUIZ_THREADS', '4'))
+timeout = int(os.environ.get('QUIZ_TIMEOUT', '30'))
+preload_app = True
+accesslog = os.environ.get('QUIZ_ACCESS_LOG')  # e.g. '-' for stdout
+
+# The in-memory session store is per process; workers must share sessions
+os.environ.setdefault('QUIZ_SESSION_BACKEND', 'sqlite')
+
+# No collections while the app is imported, so nothing is moved around before the freeze
+gc.disable()
+
+
+def when_ready(server):
+    """Runs in the master after the app (and its banks) is loaded, before any worker is forked"""
+    gc.freeze()
+    gc.enable()
+    server.log.info("Preloaded app; froze %d objects for copy-on-write sharing", gc.get_freeze_count())
+
+
+def post_fork(server, worker):
+    """Runs in each worker; with QUIZ_BACKGROUND_LOAD=1 the banks were not preloaded, so load them now"""
+    from app import BACKGROUND_LOAD, quiz_manager
+    if BACKGROUND_LOAD and quiz_manager:
+        quiz_manager.load_in_background()
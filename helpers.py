@@ -0,0 +1,97 @@
+"""Small helpers shared by the SQLite-backed stores and the bank tools."""
+import atexit
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+def natural_key(name):
+    """Sort key that puts quiz2 before quiz10"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+class LocalConnection:
+    """SQLite connection per thread and per process; call it to get the connection.
+
+    A connection must not be shared with workers forked after import, so a
+    new one is opened whenever the process id changes.
+    """
+
+    def __init__(self, path, row_factory=None, **kwargs):
+        self.path = str(path)
+        self.row_factory = row_factory
+        self.kwargs = kwargs
+        self._local = threading.local()
+
+    def __call__(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10, **self.kwargs)
+            if self.row_factory is not None:
+                conn.row_factory = self.row_factory
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class BatchWriter:
+    """Base for stores that queue writes in memory and write them in batches.
+
+    A batch is written once batch_size writes are queued, and otherwise by a
+    background thread (one per process) every flush_interval seconds, and at
+    exit. Subclasses queue writes under _lock, call _queued() afterwards, and
+    implement:
+
+    - _pending_count(): number of queued writes (called under _lock);
+    - _take_batch(): remove and return the queued writes, or None if there are
+      none (called under _lock);
+    - _write_batch(batch): write them;
+    - _restore_batch(batch): queue a batch that failed again (called under _lock).
+    """
+
+    flusher_name = 'batch-flusher'
+
+    def __init__(self, flush_interval, batch_size):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._flusher_pid = None
+        atexit.register(self.flush)
+
+    def _queued(self):
+        with self._lock:
+            full = self._pending_count() >= self.batch_size
+        self._start_flusher()
+        if full:
+            self.flush()
+
+    def _start_flusher(self):
+        if self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+
+        def run():
+            while True:
+                time.sleep(self.flush_interval)
+                try:
+                    self.flush()
+                except Exception:
+                    pass  # retried on the next tick
+        threading.Thread(target=run, name=self.flusher_name, daemon=True).start()
+
+    def flush(self):
+        with self._lock:
+            batch = self._take_batch()
+        if batch is None:
+            return
+        try:
+            self._write_batch(batch)
+        except Exception:
+            # Put the batch back so it is retried rather than lost
+            with self._lock:
+                self._restore_batch(batch)
+            raise
@@ -0,0 +1,76 @@
+"""Small response cache and conditional-request helpers.
+
+Pages are cached by a key that captures everything they depend on (bank
+version, the user's quiz and progress), and the ETag is derived from the
+same key, so a matching If-None-Match is answered with 304 before any
+template is rendered.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import Response, make_response, request
+
+
+def etag_for(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:20]
+
+
+class LRUCache:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _cache_headers(response, etag, last_modified, private):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = datetime.fromtimestamp(last_modified, timezone.utc)
+    response.cache_control.no_cache = True  # always revalidate, but allow 304s
+    if private:
+        response.cache_control.private = True
+        response.vary.add('Cookie')
+    else:
+        response.cache_control.public = True
+    return response
+
+
+def cached_page(cache, key, render, private=True):
+    """Serve render() for key from cache, answering matching conditional requests with 304"""
+    etag = etag_for(*key)
+    if etag in request.if_none_match:
+        return _cache_headers(Response(status=304), etag, None, private)
+    body = cache.get(key)
+    if body is None:
+        body = render()
+        cache.set(key, body)
+    return _cache_headers(make_response(body), etag, None, private).make_conditional(request)
+
+
+def conditional_json(data, last_modified=None, private=True):
+    """JSON response with a content-hash ETag (and optional Last-Modified timestamp)"""
+    body = json.dumps(data, ensure_ascii=False, sort_keys=True)
+    response = Response(body, mimetype='application/json')
+    etag = hashlib.sha1(body.encode('utf-8')).hexdigest()[:20]
+    return _cache_headers(response, etag, last_modified, private).make_conditional(request)
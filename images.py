@@ -0,0 +1,282 @@
+"""Manifest of quiz images and optional pre-generated WebP variants.
+
+The images directory is listed once at startup and listed again only when
+its mtime (or that of the variants directory) changes, i.e. when files are
+added, removed or renamed. QuizManager registers each bank's image
+references when the bank loads. Routes and templates then get the cleaned
+filename, size, content hash and whether the file exists from dict lookups
+instead of touching the disk per request. Only referenced images are hashed.
+Image URLs carry the hash (``?v=<digest>``) and can therefore be cached as
+immutable.
+
+Variants are built separately (Pillow required):
+
+    python images.py source_challenges/images
+"""
+import argparse
+import hashlib
+import os
+import threading
+from pathlib import Path
+
+VARIANTS_DIR = '_variants'
+VARIANT_MAX_WIDTH = 1200
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.gif')
+
+
+def clean_image_filename(image_src):
+    """Banks store Windows-style 'images\\name.jpeg'; the route wants 'name.jpeg'"""
+    return image_src.replace('\\', '/').replace('images/', '').replace('images\\', '')
+
+
+def is_inline_image(image_src):
+    """Some exports embed the image itself as a data: URI"""
+    return image_src.startswith('data:')
+
+
+def variant_name(filename):
+    return f'{VARIANTS_DIR}/{Path(filename).stem}.webp'
+
+
+class ImageInfo:
+    __slots__ = ('filename', 'size', 'digest', 'mtime_ns', 'webp')
+
+    def __init__(self, filename, size, digest, mtime_ns, webp=None):
+        self.filename = filename
+        self.size = size
+        self.digest = digest
+        self.mtime_ns = mtime_ns
+        self.webp = webp
+
+
+def _list_files(directory, prefix=''):
+    """{name: (size, mtime_ns)} of the files directly in directory"""
+    files = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    st = entry.stat()
+                    files[prefix + entry.name] = (st.st_size, st.st_mtime_ns)
+    except FileNotFoundError:
+        pass
+    return files
+
+
+class ImageManifest:
+    def __init__(self, images_dir):
+        self.images_dir = Path(images_dir)
+        self._by_filename = {}
+        self._files = {}  # every file in the directory (and its variants), from the last listing
+        self._references = {}  # quiz_id -> ((question_number, image_src, filename, alt), ...)
+        self._signature = None
+        self._report = None
+        # Bumped whenever the listing or the references change
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def _get_signature(self):
+        signature = []
+        for path in (self.images_dir, self.images_dir / VARIANTS_DIR):
+            try:
+                signature.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def refresh(self, force=False):
+        """Pick up files that were added, removed or renamed, and hashed images rewritten in place.
+        
+        The directory is only listed again when its mtime changed; hashed images are checked with
+        one stat each. True if anything changed.
+        """
+        signature = self._get_signature()
+        if signature != self._signature or force:
+            files = _list_files(self.images_dir)
+            files.update(_list_files(self.images_dir / VARIANTS_DIR, f'{VARIANTS_DIR}/'))
+            with self._lock:
+                self._signature = signature
+                self._files = files
+                filenames = {ref[2] for refs in self._references.values() for ref in refs} | set(self._by_filename)
+        else:
+            # Overwriting a file keeps the directory's mtime, so compare each hashed file's own
+            rewritten = {}
+            for filename, info in list(self._by_filename.items()):
+                try:
+                    st = os.stat(self.images_dir / filename)
+                    listed = (st.st_size, st.st_mtime_ns)
+                except OSError:
+                    listed = None
+                if listed != (info.size, info.mtime_ns):
+                    rewritten[filename] = listed
+            if not rewritten:
+                return False
+            with self._lock:
+                files = dict(self._files)
+                for filename, listed in rewritten.items():
+                    if listed is None:
+                        files.pop(filename, None)
+                    else:
+                        files[filename] = listed
+                self._files = files
+            filenames = set(rewritten)
+        self._describe_all(filenames)
+        self._changed()
+        return True
+
+    def _changed(self):
+        with self._lock:
+            self.version += 1
+            self._report = None
+
+    def _describe(self, filename):
+        listed = self._files.get(filename)
+        if listed is None:
+            return None
+        size, mtime_ns = listed
+        webp = variant_name(filename)
+        if webp not in self._files:
+            webp = None
+        current = self._by_filename.get(filename)
+        if current is not None and current.mtime_ns == mtime_ns and current.size == size:
+            if current.webp == webp:
+                return current
+            return ImageInfo(filename, size, current.digest, mtime_ns, webp)
+        digest = hashlib.sha256()
+        try:
+            with open(self.images_dir / filename, 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    digest.update(chunk)
+        except OSError:
+            return None
+        return ImageInfo(filename, size, digest.hexdigest()[:16], mtime_ns, webp)
+
+    def _describe_all(self, filenames):
+        for filename in filenames:
+            info = self._describe(filename)
+            with self._lock:
+                if info is None:
+                    self._by_filename.pop(filename, None)
+                else:
+                    self._by_filename[filename] = info
+
+    def add_questions(self, quiz_id, questions):
+        """Record a bank's image references (replacing earlier ones) and hash the files they name.
+
+        Unchanged files are not re-read.
+        """
+        if self._signature is None:
+            self.refresh()
+        references = tuple(
+            (q.question_number, q.image_src,
+             None if is_inline_image(q.image_src) else clean_image_filename(q.image_src), q.image_alt)
+            for q in questions if q.has_image and q.image_src)
+        self._describe_all({ref[2] for ref in references if ref[2]})
+        with self._lock:
+            self._references[quiz_id] = references
+        self._changed()
+
+    def remove_bank(self, quiz_id):
+        with self._lock:
+            self._references.pop(quiz_id, None)
+        self._changed()
+
+    def get(self, filename):
+        return self._by_filename.get(filename)
+
+    def is_current(self, info):
+        """Whether the file still has the size and mtime its digest was computed from"""
+        try:
+            st = os.stat(self.images_dir / info.filename)
+        except OSError:
+            return False
+        return st.st_size == info.size and st.st_mtime_ns == info.mtime_ns
+
+    def exists(self, filename):
+        """Whether the file was present at the last listing"""
+        return filename in self._files
+
+    def files(self):
+        """{name: (size, mtime_ns)} from the last listing; do not mutate"""
+        return self._files
+
+    def report(self):
+        """Images, the questions referencing them and missing/unused files; memoized until the next change"""
+        with self._lock:
+            report = self._report
+            if report is not None:
+                return report
+            version, files, references = self.version, self._files, dict(self._references)
+        questions = []
+        missing = []
+        used = set()
+        for quiz_id, refs in references.items():
+            for question_number, image_src, filename, alt in refs:
+                exists = filename is None or filename in files
+                questions.append({
+                    'quiz_id': quiz_id,
+                    'question_number': question_number,
+                    'original_image_src': image_src if filename else image_src[:64] + '...',
+                    'clean_filename': filename,
+                    'new_url': f'/quiz_images/{filename}' if filename else None,
+                    'image_alt': alt or 'No alt text',
+                    'exists': exists,
+                })
+                if filename:
+                    used.add(filename)
+                    if not exists:
+                        missing.append({'quiz_id': quiz_id, 'question_number': question_number,
+                                        'filename': filename})
+        images = [{'filename': name, 'size': size, 'referenced': name in used}
+                  for name, (size, _) in sorted(files.items())
+                  if name.lower().endswith(IMAGE_SUFFIXES)]
+        report = {
+            'images': images,
+            'questions_with_images': questions,
+            'missing_images': missing,
+            'unreferenced_images': [image['filename'] for image in images if not image['referenced']],
+        }
+        with self._lock:
+            if self.version == version:
+                self._report = report
+        return report
+
+    def for_question(self, question):
+        if not (question.has_image and question.image_src) or is_inline_image(question.image_src):
+            return None
+        return self._by_filename.get(clean_image_filename(question.image_src))
+
+
+def build_variants(images_dir, max_width=VARIANT_MAX_WIDTH, quality=80):
+    """Write a WebP copy (downscaled to max_width) of every raster image in images_dir"""
+    from PIL import Image  # optional dependency, only needed for this build step
+
+    images_dir = Path(images_dir)
+    (images_dir / VARIANTS_DIR).mkdir(exist_ok=True)
+    built = []
+    for path in sorted(images_dir.iterdir()):
+        if not path.is_file() or path.suffix.lower() not in IMAGE_SUFFIXES:
+            continue
+        out_path = images_dir / variant_name(path.name)
+        if out_path.exists() and out_path.stat().st_mtime_ns >= path.stat().st_mtime_ns:
+            continue
+        with Image.open(path) as img:
+            if img.width > max_width:
+                img = img.resize((max_width, round(img.height * max_width / img.width)))
+            img.save(out_path, 'WEBP', quality=quality)
+        built.append(out_path)
+    return built
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pre-generate WebP variants of quiz images')
+    parser.add_argument('images_dir', nargs='?', default='source_challenges/images')
+    parser.add_argument('--max-width', type=int, default=VARIANT_MAX_WIDTH)
+    parser.add_argument('--quality', type=int, default=80)
+    args = parser.parse_args(argv)
+    for out_path in build_variants(args.images_dir, args.max_width, args.quality):
+        print(f"Wrote {out_path}")
+
+
+if __name__ == '__main__':
+    main()
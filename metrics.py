@@ -0,0 +1,205 @@
+"""Request, grading and loading metrics in Prometheus text format.
+
+Every thread records into its own shard, so the hot path never takes a lock.
+A lock is used only when a thread records for the first time, and when
+/metrics sums the shards. Shards of finished threads (werkzeug starts one
+thread per connection) are folded into a retired total. Values are per
+worker process.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from flask import g, request, session
+from flask.signals import before_render_template, request_finished, request_started, template_rendered
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (64, 256, 1024, 2048, 4096, 8192, 16384, 65536)
+
+
+class _Shards:
+    """Per-thread dicts of label tuple -> value, summed only when read"""
+
+    def __init__(self, merge):
+        self._merge = merge
+        self._local = threading.local()
+        self._live = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def local(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._live.append((threading.current_thread(), shard))
+                if len(self._live) > 64:
+                    self._retire()
+        return shard
+
+    def _retire(self):
+        live = []
+        for thread, shard in self._live:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                for labels, value in shard.items():
+                    self._retired[labels] = self._merge(self._retired.get(labels), value)
+        self._live = live
+
+    def totals(self):
+        with self._lock:
+            self._retire()
+            totals = dict(self._retired)
+            shards = [shard for _, shard in self._live]
+        for shard in shards:
+            for labels, value in shard.copy().items():
+                totals[labels] = self._merge(totals.get(labels), value)
+        return totals
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = _Shards(lambda a, b: (a or 0) + b)
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shards.local()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self._shards.totals().items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # value per label set: [count per bucket (last one is +Inf)..., sum, count]
+        self._shards = _Shards(lambda a, b: list(b) if a is None else [x + y for x, y in zip(a, b)])
+
+    def observe(self, value, labels=()):
+        shard = self._shards.local()
+        data = shard.get(labels)
+        if data is None:
+            data = shard[labels] = [0] * (len(self.buckets) + 3)
+        data[bisect_left(self.buckets, value)] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    def samples(self):
+        bounds = [_number(float(b)) for b in self.buckets] + ['+Inf']
+        for labels, data in sorted(self._shards.totals().items()):
+            cumulative = 0
+            for bound, count in zip(bounds, data):
+                cumulative += count
+                le = (f'le="{bound}"',)
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_number(data[-2])}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, labels)} {data[-1]}'
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'quiz_request_duration_seconds', 'Time spent handling a request, including session save',
+    ('route', 'method', 'status')))
+TEMPLATE_RENDER = REGISTRY.register(Histogram(
+    'quiz_template_render_seconds', 'Time spent rendering a template', ('template',)))
+SESSION_SIZE = REGISTRY.register(Histogram(
+    'quiz_session_size_bytes', 'Serialized session size at the end of a request', buckets=SIZE_BUCKETS))
+BANK_LOAD = REGISTRY.register(Histogram(
+    'quiz_bank_load_seconds', 'Time spent loading a quiz bank', ('format',)))
+ANSWERS_GRADED = REGISTRY.register(Counter(
+    'quiz_answers_graded_total', 'Answers graded', ('quiz_id',)))
+ANSWERS_CORRECT = REGISTRY.register(Counter(
+    'quiz_answers_correct_total', 'Answers graded as correct', ('quiz_id',)))
+
+
+def record_answer(quiz_id, is_correct):
+    ANSWERS_GRADED.inc((quiz_id,))
+    if is_correct:
+        ANSWERS_CORRECT.inc((quiz_id,))
+
+
+def _session_size(response):
+    # Server-side sessions keep their last saved JSON blob; cookie sessions are measured by the cookie
+    blob = getattr(session, 'blob', None)
+    if blob is not None:
+        return len(blob.encode('utf-8'))
+    for header in response.headers.getlist('Set-Cookie'):
+        if header.startswith('session='):
+            return len(header.split(';', 1)[0]) - len('session=')
+    return None
+
+
+def _on_request_started(sender, **extra):
+    g._metrics_start = time.perf_counter()
+
+
+def _on_request_finished(sender, response, **extra):
+    start = g.get('_metrics_start')
+    if start is None:
+        return
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    REQUEST_LATENCY.observe(time.perf_counter() - start,
+                            (route, request.method, str(response.status_code)))
+    size = _session_size(response)
+    if size is not None:
+        SESSION_SIZE.observe(size)
+
+
+def _on_before_render(sender, template, context, **extra):
+    g.setdefault('_metrics_renders', []).append(time.perf_counter())
+
+
+def _on_rendered(sender, template, context, **extra):
+    starts = g.get('_metrics_renders')
+    if starts:
+        TEMPLATE_RENDER.observe(time.perf_counter() - starts.pop(), (template.name,))
+
+
+def init_app(app):
+    """Time requests and template renders of app (signals are connected weakly, so keep handlers module-level)"""
+    request_started.connect(_on_request_started, app)
+    request_finished.connect(_on_request_finished, app)
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_rendered, app)
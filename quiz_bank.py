@@ -0,0 +1,181 @@
+"""Question objects and the compiled quiz bank format.
+
+A compiled bank (``quizN_questions.qbank``) is produced from the JSON bank by
+
+    python quiz_bank.py source_challenges
+
+and holds a small JSON header followed by a marshal-encoded tuple of rows.
+Loading it skips JSON parsing and dict construction entirely; QuizManager
+prefers it while it still matches its JSON source and falls back to JSON
+otherwise.
+"""
+import argparse
+import json
+import marshal
+import os
+import struct
+from pathlib import Path
+
+MAGIC = b'QBNK'
+FORMAT_VERSION = 2
+COMPILED_SUFFIX = '.qbank'
+_HEADER = struct.Struct('<4sHI')  # magic, format version, header length
+
+
+class Question:
+    """Compact, read-only view of one question"""
+
+    __slots__ = ('question_number', 'question_text', 'options', 'correct_answer',
+                 'has_image', 'image_src', 'image_alt', 'section', 'answer_key')
+
+    # Row layout used by the compiled format
+    FIELDS = ('question_number', 'question_text', 'options', 'correct_answer',
+              'has_image', 'image_src', 'image_alt', 'section')
+
+    def __init__(self, question_number, question_text, options, correct_answer,
+                 has_image=False, image_src='', image_alt='', section=''):
+        self.question_number = question_number
+        self.question_text = question_text
+        self.options = tuple(options)
+        self.correct_answer = correct_answer
+        self.has_image = has_image
+        self.image_src = image_src
+        self.image_alt = image_alt
+        # Optional grouping within a bank, used to stratify sampling
+        self.section = section
+        self.answer_key = correct_answer.strip()
+
+    @classmethod
+    def from_dict(cls, q):
+        has_image = bool(q.get('has_image', False))
+        return cls(
+            q['question_number'],
+            q.get('question_text', ''),
+            q.get('options', []),
+            q.get('correct_answer', ''),
+            has_image,
+            q.get('image_src', '') if has_image else '',
+            q.get('image_alt', '') if has_image else '',
+            q.get('section', ''),
+        )
+
+    def to_row(self):
+        return (self.question_number, self.question_text, self.options, self.correct_answer,
+                self.has_image, self.image_src, self.image_alt, self.section)
+
+    def to_dict(self):
+        d = {name: getattr(self, name) for name in self.FIELDS}
+        d['options'] = list(self.options)
+        return d
+
+    def __repr__(self):
+        return f'Question({self.question_number!r}, {self.question_text[:20]!r})'
+
+
+def compiled_path_for(json_path):
+    json_path = Path(json_path)
+    return json_path.with_suffix(COMPILED_SUFFIX)
+
+
+def load_json_bank(json_path):
+    """Parse a JSON bank, returning (title or None, tuple of Question)"""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data.get('title'), tuple(Question.from_dict(q) for q in data['questions'])
+
+
+def source_signature(json_path):
+    try:
+        st = os.stat(json_path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def compile_bank(json_path, out_path=None):
+    """Write the compiled form of a JSON bank next to it (or to out_path)"""
+    json_path = Path(json_path)
+    out_path = Path(out_path) if out_path else compiled_path_for(json_path)
+    title, questions = load_json_bank(json_path)
+    header = json.dumps({
+        'title': title,
+        'count': len(questions),
+        'source': source_signature(json_path),
+    }).encode('utf-8')
+    body = marshal.dumps(tuple(q.to_row() for q in questions), 4)
+    tmp_path = out_path.with_name(out_path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write(body)
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def read_compiled_header(path):
+    """Return the header of a compiled bank (title, count, source) without loading its rows"""
+    with open(path, 'rb') as f:
+        raw = f.read(_HEADER.size)
+        if len(raw) != _HEADER.size:
+            return None
+        magic, version, header_len = _HEADER.unpack(raw)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            return None
+        return _parse_header(f.read(header_len), header_len)
+
+
+def _parse_header(raw, header_len):
+    """Header dict, or None if it is truncated or not valid JSON"""
+    if len(raw) != header_len:
+        return None
+    try:
+        header = json.loads(raw)
+    except ValueError:
+        return None
+    return header if isinstance(header, dict) else None
+
+
+def load_compiled_bank(path, source_path=None):
+    """Load a compiled bank, returning (title or None, tuple of Question).
+
+    Returns None when the file is not a usable compiled bank or when
+    source_path is given and has changed since the bank was compiled.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        magic, version, header_len = _HEADER.unpack_from(data)
+    except struct.error:  # shorter than the fixed header
+        return None
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+    header_end = _HEADER.size + header_len
+    header = _parse_header(data[_HEADER.size:header_end], header_len)
+    if header is None:
+        return None
+    if source_path is not None:
+        signature = source_signature(source_path)
+        if signature is not None and signature != header.get('source'):
+            return None
+    try:
+        rows = marshal.loads(memoryview(data)[header_end:])
+        questions = tuple(Question(*row) for row in rows)
+    except (EOFError, ValueError, TypeError):
+        return None
+    return header.get('title'), questions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compile JSON quiz banks into the .qbank format')
+    parser.add_argument('paths', nargs='+', help='JSON bank files or directories containing <id>_questions.json')
+    args = parser.parse_args(argv)
+
+    for path in map(Path, args.paths):
+        sources = sorted(path.glob('*_questions.json')) if path.is_dir() else [path]
+        for source in sources:
+            out_path = compile_bank(source)
+            print(f"Compiled {source} -> {out_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+"""Discovery, loading and hot reload of quiz banks.
+
+QuizManager finds the <id>_questions.json (or compiled .qbank) banks in a
+directory, loads them on first use and reloads them when their files change.
+It also builds each bank's answer keys, display fields, question sampler,
+image references and search index. Importing this module has no side
+effects, so offline tools (rescore.py) can grade without the web app.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import metrics
+from grading import MULTIPLE, resolve_key
+from helpers import natural_key
+from images import ImageManifest, clean_image_filename, is_inline_image
+from quiz_bank import (compiled_path_for, load_compiled_bank, load_json_bank,
+                       read_compiled_header, source_signature)
+from sampling import QuestionSampler
+from search import SearchIndex
+
+logger = logging.getLogger('quiz')
+
+BANK_FILE_RE = re.compile(r'^(?P<quiz_id>.+)_questions\.(?:json|qbank)$')
+MANIFEST_NAME = 'banks.json'
+
+
+def _display_fields(question, key):
+    """Values the quiz page shows for a question, derived once per bank load instead of per render"""
+    # Option labels; the form submits the option's index
+    labels = []
+    for i, option in enumerate(question.options or key.options):
+        if option[:2] in ('A.', 'B.', 'C.', 'D.'):
+            labels.append(option)
+        else:
+            labels.append(f'{chr(ord("A") + i)}. {option}')
+    image_filename = ''
+    if question.has_image and question.image_src and not is_inline_image(question.image_src):
+        image_filename = clean_image_filename(question.image_src)
+    return {'options': tuple(labels), 'multiple': key.kind == MULTIPLE, 'image_filename': image_filename}
+
+
+class QuizManager:
+    def __init__(self, base_path, reload_interval=0):
+        self.base_path = Path(base_path)
+        # Discovered banks (quiz_id -> path and metadata); loaded lazily into self.quizzes
+        self.banks = {}
+        self.quizzes = {}
+        self.images = ImageManifest(self.base_path / 'images')
+        self.images.refresh()
+        self.search = SearchIndex()
+        # Bumped whenever a bank is (re)loaded or discovered so caches can key on it
+        self.version = 0
+        self.last_modified = time.time()
+        self._available_cache = None
+        self.reload_interval = reload_interval
+        self.reload_status = {'last_check': None, 'reloads': 0, 'banks': {}}
+        self._signatures = {}
+        # Banks whose last load failed -> the file signature it failed with
+        self._failed = {}
+        self._discovery_signature = None
+        self._next_check = 0
+        self._load_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._background_pid = None
+        # Seconds the last load_in_background() took, once it finished
+        self.background_load_seconds = None
+        self.discover_banks()
+        logger.info("QuizManager initialized. Found %d quizzes in %s: %s",
+                    len(self.banks), self.base_path, list(self.banks))
+    
+    def discover_banks(self):
+        """Find available banks from banks.json or a single directory scan, without loading them"""
+        if not self.base_path.exists():
+            logger.info("Creating directory: %s", self.base_path)
+            self.base_path.mkdir(parents=True, exist_ok=True)
+        
+        manifest = self.base_path / MANIFEST_NAME
+        if manifest.exists():
+            banks = self._read_manifest(manifest)
+        else:
+            banks = {}
+            with os.scandir(self.base_path) as entries:
+                for entry in entries:
+                    match = BANK_FILE_RE.match(entry.name)
+                    if match and entry.is_file():
+                        quiz_id = match.group('quiz_id')
+                        banks[quiz_id] = {'path': self.base_path / f'{quiz_id}_questions.json'}
+        
+        # Keep metadata of banks we already knew about
+        old_ids = list(self.banks)
+        self.banks = {quiz_id: self.banks.get(quiz_id, banks[quiz_id])
+                      for quiz_id in sorted(banks, key=natural_key)}
+        if list(self.banks) != old_ids:
+            self._bump_version()
+        self._discovery_signature = self._get_discovery_signature()
+        self._next_check = time.monotonic() + self.reload_interval
+        return list(self.banks)
+    
+    def _get_discovery_signature(self):
+        """Directory and manifest mtimes; a change means banks may have been added"""
+        signature = []
+        for path in (self.base_path, self.base_path / MANIFEST_NAME):
+            try:
+                signature.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+    
+    def _bump_version(self):
+        self.version += 1
+        self.last_modified = time.time()
+        self._available_cache = None
+    
+    def _read_manifest(self, manifest):
+        """banks.json: {"banks": [{"id", "file", "title"?, "total_questions"?}, ...]}"""
+        with open(manifest, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        banks = {}
+        for item in data.get('banks', []):
+            bank = {'path': self.base_path / item.get('file', f"{item['id']}_questions.json")}
+            if 'title' in item:
+                bank['title'] = item['title']
+            if 'total_questions' in item:
+                bank['total_questions'] = item['total_questions']
+            banks[item['id']] = bank
+        return banks
+    
+    def load_all_quizzes(self):
+        """Eagerly load every discovered bank"""
+        for quiz_id in self.banks:
+            self.get_quiz(quiz_id)
+        return self.quizzes
+    
+    def load_in_background(self):
+        """Load every bank on a daemon thread (once per process) while requests are already served"""
+        if self._background_pid == os.getpid():
+            return None
+        self._background_pid = os.getpid()
+        
+        def run():
+            started = time.perf_counter()
+            self.load_all_quizzes()
+            self.background_load_seconds = round(time.perf_counter() - started, 4)
+            logger.info("Loaded %d banks in the background in %.1f ms",
+                        len(self.quizzes), self.background_load_seconds * 1000)
+        thread = threading.Thread(target=run, name='bank-loader', daemon=True)
+        thread.start()
+        return thread
+    
+    def get_quiz(self, quiz_id):
+        """Loaded bank entry, loading it on first access; None for unknown or unreadable banks"""
+        quiz = self.quizzes.get(quiz_id)
+        if quiz is not None or quiz_id not in self.banks:
+            return quiz
+        if quiz_id in self._failed and self.reload_interval:
+            return None  # retried by the reload poll once its files change
+        with self._load_lock:
+            if quiz_id not in self.quizzes:
+                signature = self._bank_signature(quiz_id)
+                # A bank that failed to load is not parsed again until its files change
+                if self._failed.get(quiz_id) == signature:
+                    return None
+                self._signatures[quiz_id] = signature
+                self._record_load(quiz_id, signature, self._load_bank(quiz_id))
+        return self.quizzes.get(quiz_id)
+    
+    def _record_load(self, quiz_id, signature, loaded):
+        if loaded:
+            self._failed.pop(quiz_id, None)
+        else:
+            self._failed[quiz_id] = signature
+    
+    def _bank_path(self, quiz_id):
+        bank = self.banks.get(quiz_id)
+        return bank['path'] if bank else self.base_path / f'{quiz_id}_questions.json'
+    
+    def _default_title(self, quiz_id):
+        bank = self.banks.get(quiz_id, {})
+        if 'title' in bank:
+            return bank['title']
+        number = quiz_id[len('quiz'):]
+        return f'软件测试题库 {number}' if quiz_id.startswith('quiz') and number.isdigit() else quiz_id
+    
+    def _bank_signature(self, quiz_id):
+        """(inode, mtime, size) of the JSON and compiled files; None entries for missing files"""
+        signature = []
+        for path in (self._bank_path(quiz_id), compiled_path_for(self._bank_path(quiz_id))):
+            try:
+                st = os.stat(path)
+                signature.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+    
+    def _load_bank(self, quiz_id):
+        """Load one bank and swap it in; the previous version stays live on failure"""
+        quiz_file = self._bank_path(quiz_id)
+        compiled_file = compiled_path_for(quiz_file)
+        status = self.reload_status['banks'].setdefault(quiz_id, {'loads': 0, 'loaded_at': None, 'last_error': None})
+        started = time.perf_counter()
+        try:
+            loaded = None
+            file_format = 'compiled'
+            if compiled_file.exists():
+                try:
+                    loaded = load_compiled_bank(compiled_file, source_path=quiz_file)
+                except OSError as e:
+                    logger.warning("Cannot read compiled bank %s (%s), falling back to JSON", compiled_file, e)
+                else:
+                    if loaded is None:
+                        logger.warning("Compiled bank %s is stale or invalid, falling back to JSON", compiled_file)
+            if loaded is None and quiz_file.exists():
+                loaded = load_json_bank(quiz_file)
+                file_format = 'json'
+            if loaded is None:
+                status['last_error'] = f'File not found: {quiz_file}'
+                return False
+            
+            title, questions = loaded
+            keys = {q.question_number: resolve_key(q) for q in questions}
+            entry = {
+                'questions': questions,
+                'index': {q.question_number: q for q in questions},
+                'keys': keys,
+                'display': {q.question_number: _display_fields(q, keys[q.question_number]) for q in questions},
+                'sampler': QuestionSampler(questions),
+                'title': title or self._default_title(quiz_id),
+                'file': str(compiled_file if file_format == 'compiled' else quiz_file),
+                'format': file_format
+            }
+            self.images.add_questions(quiz_id, questions)
+            self.search.update_bank(quiz_id, questions)
+        except Exception as e:
+            logger.error("Error loading %s: %s", quiz_file, e)
+            status['last_error'] = str(e)
+            return False
+        
+        # Single assignment, so concurrent readers see either the old or the new bank
+        self.quizzes[quiz_id] = entry
+        elapsed = time.perf_counter() - started
+        metrics.BANK_LOAD.observe(elapsed, (file_format,))
+        self._bump_version()
+        status.update(loads=status['loads'] + 1, loaded_at=datetime.now().isoformat(), load_ms=round(elapsed * 1000, 2),
+                      last_error=None, format=file_format, questions=len(questions))
+        logger.info("Loaded %s with %d questions in %.1f ms", entry['file'], len(questions), elapsed * 1000)
+        return True
+    
+    def maybe_reload(self):
+        """Reload changed banks if the polling interval has elapsed; cheap to call per request"""
+        if not self.reload_interval or time.monotonic() < self._next_check:
+            return []
+        if not self._reload_lock.acquire(blocking=False):
+            return []  # another thread is already checking
+        try:
+            self._next_check = time.monotonic() + self.reload_interval
+            return self.reload_changed()
+        finally:
+            self._reload_lock.release()
+    
+    def reload_changed(self):
+        """Pick up new bank files and reload only the loaded banks whose files changed"""
+        if self._get_discovery_signature() != self._discovery_signature:
+            try:
+                self.discover_banks()
+            except Exception as e:
+                logger.error("Error rescanning %s: %s", self.base_path, e)
+        
+        if self.images.refresh():
+            # Question bodies embed image URLs and their content hashes
+            self._bump_version()
+        
+        reloaded = []
+        for quiz_id, old_signature in list(self._signatures.items()):
+            signature = self._bank_signature(quiz_id)
+            if signature == old_signature:
+                continue
+            self._signatures[quiz_id] = signature
+            if signature == (None, None):
+                continue  # deleted; keep serving the last good version
+            loaded = self._load_bank(quiz_id)
+            self._record_load(quiz_id, signature, loaded)
+            if loaded:
+                logger.info("Reloaded %s from %s", quiz_id, self.quizzes[quiz_id]['file'])
+                reloaded.append(quiz_id)
+        self.reload_status['last_check'] = datetime.now().isoformat()
+        self.reload_status['reloads'] += len(reloaded)
+        return reloaded
+    
+    def load_progress(self):
+        """How many discovered banks are loaded, and which failed to load.
+        
+        complete means every bank was attempted: failed banks are reported, not waited for.
+        """
+        banks = list(self.banks)
+        loaded = [quiz_id for quiz_id in banks if quiz_id in self.quizzes]
+        failed = {quiz_id: self.reload_status['banks'].get(quiz_id, {}).get('last_error') for quiz_id in banks
+                  if quiz_id not in self.quizzes and quiz_id in self._failed}
+        return {'discovered': len(banks), 'loaded': len(loaded), 'failed': failed,
+                'complete': len(loaded) + len(failed) == len(banks)}
+    
+    def get_answer_key(self, quiz_id, question_number):
+        quiz = self.get_quiz(quiz_id)
+        return quiz['keys'].get(question_number) if quiz else None
+    
+    def get_display(self, quiz_id, question_number):
+        quiz = self.get_quiz(quiz_id)
+        return quiz['display'].get(question_number) if quiz else None
+    
+    def get_title(self, quiz_id, default='Quiz'):
+        quiz = self.get_quiz(quiz_id)
+        return quiz['title'] if quiz else default
+    
+    def _bank_metadata(self, quiz_id):
+        """Title and size, from the manifest or compiled header when possible to avoid a load"""
+        bank = self.banks[quiz_id]
+        quiz = self.quizzes.get(quiz_id)
+        if quiz is not None:
+            return {'title': quiz['title'], 'total_questions': len(quiz['questions'])}
+        if 'total_questions' in bank:
+            return {'title': self._default_title(quiz_id), 'total_questions': bank['total_questions']}
+        compiled_file = compiled_path_for(bank['path'])
+        try:
+            header = read_compiled_header(compiled_file)
+        except (OSError, ValueError):
+            header = None
+        if header is not None and header.get('source') in (None, source_signature(bank['path'])):
+            return {'title': header.get('title') or self._default_title(quiz_id),
+                    'total_questions': header['count']}
+        quiz = self.get_quiz(quiz_id)
+        if quiz is None:
+            return None
+        return {'title': quiz['title'], 'total_questions': len(quiz['questions'])}
+    
+    def get_available_quizzes(self):
+        """Get list of available quizzes (memoized until the next bank load; do not mutate)"""
+        cached = self._available_cache
+        if cached is not None and cached[0] == self.version:
+            return cached[1]
+        available = {}
+        for quiz_id in list(self.banks):
+            metadata = self._bank_metadata(quiz_id)
+            if metadata is not None:
+                available[quiz_id] = metadata
+        # Lazily loading a bank above bumps the version, so read it afterwards
+        self._available_cache = (self.version, available)
+        return available
+    
+    def get_random_questions(self, quiz_id, count=10, seen=(), wrong=()):
+        """Draw questions avoiding seen numbers and favouring previously wrong ones"""
+        quiz = self.get_quiz(quiz_id)
+        if not quiz:
+            return []
+        index = quiz['index']
+        return [index[n] for n in quiz['sampler'].draw(count, seen=seen, wrong=wrong)]
+    
+    def get_question_numbers(self, quiz_id):
+        """Distinct question numbers of the bank"""
+        quiz = self.get_quiz(quiz_id)
+        return quiz['sampler'].numbers if quiz else frozenset()
+    
+    def get_question(self, quiz_id, question_number):
+        """O(1) lookup through the per-quiz index built at load time"""
+        quiz = self.get_quiz(quiz_id)
+        if not quiz:
+            return None
+        return quiz['index'].get(question_number)
+    
+    def get_questions(self, quiz_id, question_numbers):
+        """Resolve a list of question numbers, skipping any that no longer exist"""
+        quiz = self.get_quiz(quiz_id)
+        if not quiz:
+            return []
+        index = quiz['index']
+        return [index[n] for n in question_numbers if n in index]
+    
+    def check_answer(self, quiz_id, question_number, submission):
+        """Grade an option index, a list of indices (multi-select) or answer text"""
+        key = self.get_answer_key(quiz_id, question_number)
+        return key.grade(submission) if key else False
+    
+    def grade_answers(self, quiz_id, answers):
+        """Grade (question_number, submission) pairs in one pass.
+        
+        Returns (question, submission, is_correct) tuples; unknown questions are skipped.
+        """
+        quiz = self.get_quiz(quiz_id)
+        if not quiz:
+            return []
+        index, keys = quiz['index'], quiz['keys']
+        results = []
+        for question_number, submission in answers:
+            question = index.get(question_number)
+            if question is not None:
+                results.append((question, submission, keys[question_number].grade(submission)))
+        return results
+
+
+def default_bank_dir():
+    """QUIZ_BANK_DIR, else source_challenges in the working directory, else next to this file"""
+    return os.environ.get('QUIZ_BANK_DIR') or (
+        'source_challenges' if os.path.isdir('source_challenges') else str(Path(__file__).parent / 'source_challenges'))
@@ -0,0 +1,323 @@
+"""Offline re-scoring of exported attempts, with item statistics per question.
+
+Export the answers recorded by the app, then grade them against the current
+banks (e.g. after correcting an answer key):
+
+    python rescore.py export instance/analytics.sqlite3 -o answers.jsonl
+    python rescore.py export --backend shared --state instance/state.sqlite3 -o answers.jsonl
+    python rescore.py score answers.jsonl --scores rescored.jsonl --report report.json
+
+Each log line is either one answer
+({"user_id", "quiz_id", "attempt", "question_number", "user_answer", "correct"})
+or a whole attempt ({"user_id", "quiz_id", "attempt", "answers": {...}}, with
+answers as accepted by /api/submit_attempt). Consecutive answer lines of the
+same user, quiz and attempt form one attempt, which is how `export` orders
+them. Attempts are graded in chunks on a process pool. Only a bounded number
+of chunks is in flight, and workers return running sums rather than records,
+so memory stays flat however long the log is.
+
+Per question the report gives:
+
+- difficulty: the share of answers that are correct;
+- discrimination: the point-biserial correlation between answering the
+  question correctly and the rest of the attempt's score;
+- distractors: how often each option (or set of options) was chosen, and the
+  mean rest score of those who chose it.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+
+from analytics import init_analytics
+from quiz_manager import QuizManager, default_bank_dir
+from shared_state import SQLiteStateStore
+
+CHUNK_SIZE = 500
+# Flag questions that are too easy/hard or do not separate strong from weak attempts
+EASY_ABOVE = 0.9
+HARD_BELOW = 0.2
+LOW_DISCRIMINATION = 0.2
+
+_manager = None
+
+
+def _init_worker(bank_dir):
+    # Forked workers inherit the parent's loaded banks; spawned ones load their own
+    global _manager
+    if _manager is None or str(_manager.base_path) != bank_dir:
+        _manager = QuizManager(bank_dir)
+        _manager.load_all_quizzes()
+
+
+def read_attempts(paths):
+    """Yield (user_id, quiz_id, attempt, [(question_number, answer, logged_correct)]) from JSONL logs"""
+    for path in paths:
+        f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        try:
+            group_key, answers = None, []
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                key = (record.get('user_id'), record.get('quiz_id'), record.get('attempt'))
+                if 'answers' in record:
+                    raw = record['answers']
+                    if isinstance(raw, dict):
+                        pairs = [(int(n), a, None) for n, a in raw.items()]
+                    else:
+                        pairs = [(int(a['question_number']), a.get('answer'), a.get('correct')) for a in raw]
+                    yield (*key, pairs)
+                    continue
+                if key != group_key:
+                    if answers:
+                        yield (*group_key, answers)
+                    group_key, answers = key, []
+                answers.append((int(record['question_number']), record.get('user_answer'), record.get('correct')))
+            if answers:
+                yield (*group_key, answers)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def _choice_label(key, submission):
+    """Letters of the chosen options ('A', 'AC'), 'blank' or 'other'"""
+    if submission in (None, '', []):
+        return 'blank'
+    indices = key.normalize(submission)
+    if indices is None:
+        return 'other'
+    return ''.join(chr(ord('A') + i) for i in sorted(indices))
+
+
+def score_chunk(attempts):
+    """Grade a chunk of attempts; returns (per-question sums, rescored attempts, skipped answers)"""
+    stats = {}
+    scores = []
+    skipped = 0
+    for user_id, quiz_id, attempt, answers in attempts:
+        graded = _manager.grade_answers(quiz_id, [(n, a) for n, a, _ in answers])
+        skipped += len(answers) - len(graded)
+        score = sum(is_correct for _, _, is_correct in graded)
+        logged = [c for _, _, c in answers if c is not None]
+        scores.append({'user_id': user_id, 'quiz_id': quiz_id, 'attempt': attempt,
+                       'score': score, 'total': len(graded),
+                       'logged_score': sum(map(bool, logged)) if len(logged) == len(answers) else None})
+        for question, submission, is_correct in graded:
+            number = question.question_number
+            rest = score - is_correct
+            s = stats.get((quiz_id, number))
+            if s is None:
+                s = stats[(quiz_id, number)] = [0, 0, 0, 0, 0, {}]
+            s[0] += 1
+            s[1] += is_correct
+            s[2] += rest
+            s[3] += rest * rest
+            s[4] += rest * is_correct
+            label = _choice_label(_manager.get_answer_key(quiz_id, number), submission)
+            choice = s[5].setdefault(label, [0, 0])
+            choice[0] += 1
+            choice[1] += rest
+    return stats, scores, skipped
+
+
+def merge_stats(total, part):
+    for key, s in part.items():
+        t = total.get(key)
+        if t is None:
+            total[key] = s
+            continue
+        for i in range(5):
+            t[i] += s[i]
+        for label, (count, rest) in s[5].items():
+            choice = t[5].setdefault(label, [0, 0])
+            choice[0] += count
+            choice[1] += rest
+
+
+def _point_biserial(n, correct, sum_rest, sum_rest2, sum_x_rest):
+    if n < 2:
+        return None
+    p = correct / n
+    mean_rest = sum_rest / n
+    var_rest = sum_rest2 / n - mean_rest * mean_rest
+    var_x = p * (1 - p)
+    if var_rest <= 1e-12 or var_x <= 0:
+        return None
+    return (sum_x_rest / n - p * mean_rest) / math.sqrt(var_x * var_rest)
+
+
+def build_report(stats, manager):
+    """{quiz_id: [question report, ...]} ordered by question number"""
+    report = {}
+    for (quiz_id, number), (n, correct, sum_rest, sum_rest2, sum_x_rest, choices) in sorted(stats.items()):
+        key = manager.get_answer_key(quiz_id, number)
+        difficulty = correct / n
+        discrimination = _point_biserial(n, correct, sum_rest, sum_rest2, sum_x_rest)
+        correct_label = _choice_label(key, sorted(key.indices)) if key.indices else None
+        distractors = {}
+        if key.indices:
+            # Every option, so never-chosen distractors show up with a count of 0
+            for label in (chr(ord('A') + i) for i in range(len(key.options))):
+                distractors[label] = {'count': 0, 'share': 0.0, 'mean_rest': None}
+        for label, (count, rest) in sorted(choices.items()):
+            distractors[label] = {'count': count, 'share': round(count / n, 4),
+                                  'mean_rest': round(rest / count, 3)}
+        flags = []
+        if difficulty > EASY_ABOVE:
+            flags.append('easy')
+        elif difficulty < HARD_BELOW:
+            flags.append('hard')
+        if discrimination is not None and discrimination < LOW_DISCRIMINATION:
+            flags.append('negative discrimination' if discrimination < 0 else 'low discrimination')
+        correct_rest = distractors.get(correct_label, {}).get('mean_rest')
+        for label, d in distractors.items():
+            if label == correct_label or label in ('blank', 'other'):
+                continue
+            if d['count'] == 0:
+                flags.append(f'{label} never chosen')
+            elif correct_rest is not None and d['mean_rest'] > correct_rest:
+                flags.append(f'{label} attracts stronger attempts')
+        report.setdefault(quiz_id, []).append({
+            'question_number': number,
+            'answered': n,
+            'correct': correct,
+            'difficulty': round(difficulty, 4),
+            'discrimination': None if discrimination is None else round(discrimination, 4),
+            'correct_option': correct_label,
+            'distractors': distractors,
+            'flags': flags,
+        })
+    return report
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def rescore(paths, bank_dir, workers=None, chunk_size=CHUNK_SIZE, scores_out=None):
+    """Grade every attempt in the logs; returns (report, summary)"""
+    _init_worker(bank_dir)  # loaded once here so forked workers share it
+    workers = workers or os.cpu_count() or 1
+    stats = {}
+    summary = {'attempts': 0, 'answers': 0, 'skipped_answers': 0, 'changed_scores': 0}
+
+    def collect(result):
+        part, scores, skipped = result
+        merge_stats(stats, part)
+        summary['attempts'] += len(scores)
+        summary['answers'] += sum(s['total'] for s in scores)
+        summary['skipped_answers'] += skipped
+        for s in scores:
+            if s['logged_score'] is not None and s['logged_score'] != s['score']:
+                summary['changed_scores'] += 1
+            if scores_out:
+                scores_out.write(json.dumps(s, ensure_ascii=False) + '\n')
+
+    chunks = _chunks(read_attempts(paths), chunk_size)
+    if workers == 1:
+        for chunk in chunks:
+            collect(score_chunk(chunk))
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(bank_dir,)) as pool:
+            pending = set()
+            for chunk in chunks:
+                # Bounded in-flight work keeps the reader from running ahead of the pool
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future.result())
+                pending.add(pool.submit(score_chunk, chunk))
+            for future in pending:
+                collect(future.result())
+    return build_report(stats, _manager), summary
+
+
+def export_answers(store, out):
+    """Write an AnalyticsStore's answers as JSONL, grouped by attempt"""
+    count = 0
+    for record in store.export_answers():
+        out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+def open_analytics(backend, db_path, state_path):
+    """The app's analytics store: the SQLite file, or the shared state store"""
+    if backend == 'sqlite':
+        if not os.path.exists(db_path):
+            raise SystemExit(f"No analytics database at {db_path}")
+        return init_analytics('sqlite', db_path)
+    return init_analytics(backend, state=SQLiteStateStore(state_path))
+
+
+def print_report(report, summary):
+    print(f"{summary['attempts']} attempts, {summary['answers']} answers graded, "
+          f"{summary['skipped_answers']} skipped (question not in bank), "
+          f"{summary['changed_scores']} attempts with a changed score")
+    for quiz_id, questions in report.items():
+        print(f"\n{quiz_id}")
+        print(f"  {'#':>4} {'n':>6} {'difficulty':>10} {'discrim.':>9}  flags")
+        for q in questions:
+            discrimination = '-' if q['discrimination'] is None else f"{q['discrimination']:.3f}"
+            print(f"  {q['question_number']:>4} {q['answered']:>6} {q['difficulty']:>10.3f} {discrimination:>9}  "
+                  f"{', '.join(q['flags'])}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Re-score exported quiz attempts and report item statistics')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export = commands.add_parser('export', help='Export recorded answers from the analytics store as JSONL')
+    export.add_argument('db', nargs='?', default=os.environ.get('QUIZ_ANALYTICS_DB', 'instance/analytics.sqlite3'),
+                        help='Analytics database of the sqlite backend (default: %(default)s)')
+    export.add_argument('--backend', choices=('sqlite', 'shared'),
+                        default=os.environ.get('QUIZ_ANALYTICS_BACKEND', 'sqlite'),
+                        help='Analytics backend the app runs with (default: %(default)s)')
+    export.add_argument('--state', default=os.environ.get('QUIZ_STATE_SQLITE_PATH', 'instance/state.sqlite3'),
+                        help='State store of the shared backend (default: %(default)s)')
+    export.add_argument('-o', '--output', help='Output file (default: stdout)')
+
+    score = commands.add_parser('score', help='Grade JSONL attempt logs against the current banks')
+    score.add_argument('logs', nargs='+', help="JSONL files ('-' for stdin)")
+    score.add_argument('--banks', default=default_bank_dir(), help='Bank directory (default: %(default)s)')
+    score.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+    score.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Attempts per task')
+    score.add_argument('--scores', help='Write the re-scored attempts to this JSONL file')
+    score.add_argument('--report', help='Write the full report (with distractors) to this JSON file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            count = export_answers(open_analytics(args.backend, args.db, args.state), out)
+        finally:
+            if args.output:
+                out.close()
+        print(f"Exported {count} answers", file=sys.stderr)
+        return
+
+    scores_out = open(args.scores, 'w', encoding='utf-8') if args.scores else None
+    try:
+        report, summary = rescore(args.logs, args.banks, args.workers, args.chunk_size, scores_out)
+    finally:
+        if scores_out:
+            scores_out.close()
+    print_report(report, summary)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'summary': summary, 'quizzes': report}, f, ensure_ascii=False, indent=2)
+        print(f"\nWrote {args.report}")
+
+
+if __name__ == '__main__':
+    main()
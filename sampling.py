@@ -0,0 +1,110 @@
+"""Question sampling for quiz attempts.
+
+Each bank gets a QuestionSampler built once at load time. It keeps the
+question numbers in flat index arrays grouped by section, so a draw only
+touches the k positions it picks: unseen questions are found by rejection
+sampling against the user's seen set, which stays O(k) expected while at
+least a constant fraction of the bank is unseen. NumPy is used to generate
+candidate positions in bulk when it is installed.
+"""
+import random
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # optional
+    np = None
+
+
+class QuestionSampler:
+    """Draws question numbers without repeats, weighted toward wrong answers"""
+
+    # Candidate positions generated per needed question before giving up on
+    # rejection sampling and filtering the stratum directly
+    REJECTION_FACTOR = 4
+
+    def __init__(self, questions, seed=None):
+        strata = {}
+        numbers = set()
+        for q in questions:
+            # A number listed twice in a bank is still one question (the index keeps one of them)
+            if q.question_number in numbers:
+                continue
+            numbers.add(q.question_number)
+            strata.setdefault(getattr(q, 'section', '') or '', []).append(q.question_number)
+        self.strata = {section: array('q', numbers) for section, numbers in strata.items()}
+        self.numbers = frozenset(numbers)
+        self.size = len(self.numbers)
+        self._random = random.Random(seed)
+        self._np_rng = np.random.default_rng(seed) if np is not None else None
+
+    def _positions(self, n, m):
+        if self._np_rng is not None:
+            return self._np_rng.integers(0, n, size=m).tolist()
+        return [self._random.randrange(n) for _ in range(m)]
+
+    def _allocate(self, count):
+        """Split count across sections proportionally to their size (largest remainder)"""
+        if len(self.strata) == 1:
+            return {section: count for section in self.strata}
+        quotas = {s: count * len(nums) / self.size for s, nums in self.strata.items()}
+        allocation = {s: int(q) for s, q in quotas.items()}
+        remainder = count - sum(allocation.values())
+        for s in sorted(quotas, key=lambda s: quotas[s] - allocation[s], reverse=True)[:remainder]:
+            allocation[s] += 1
+        return allocation
+
+    def _draw_stratum(self, numbers, need, excluded):
+        picked = []
+        n = len(numbers)
+        if need <= 0 or n == 0:
+            return picked
+        for pos in self._positions(n, need * self.REJECTION_FACTOR):
+            number = numbers[pos]
+            if number not in excluded:
+                excluded.add(number)
+                picked.append(number)
+                if len(picked) == need:
+                    return picked
+        # Mostly-seen stratum: fall back to a direct scan
+        remaining = [number for number in numbers if number not in excluded]
+        extra = self._random.sample(remaining, min(need - len(picked), len(remaining)))
+        excluded.update(extra)
+        return picked + extra
+
+    def draw(self, count, seen=(), wrong=(), wrong_ratio=0.3):
+        """Pick up to count question numbers.
+
+        Up to wrong_ratio of the draw comes from previously wrong questions
+        (which may repeat); the rest is stratified by section and avoids
+        everything in seen. If the unseen pool runs short, seen questions
+        fill the gap so the attempt is still full size.
+        """
+        count = min(count, self.size)
+        chosen = []
+        excluded = set(seen)
+
+        wrong_pool = list(dict.fromkeys(n for n in wrong if n in self.numbers))
+        if wrong_pool and wrong_ratio > 0:
+            k_wrong = min(len(wrong_pool), int(round(count * wrong_ratio)))
+            chosen.extend(self._random.sample(wrong_pool, k_wrong))
+            excluded.update(chosen)
+
+        allocation = self._allocate(count - len(chosen))
+        for section, need in allocation.items():
+            chosen.extend(self._draw_stratum(self.strata[section], need, excluded))
+
+        # A short section leaves a gap; top up from other sections, and once
+        # the whole bank has been seen, from seen questions as well
+        for numbers in self.strata.values():
+            if len(chosen) >= count:
+                break
+            chosen.extend(self._draw_stratum(numbers, count - len(chosen), excluded))
+        taken = set(chosen)
+        for numbers in self.strata.values():
+            if len(chosen) >= count:
+                break
+            chosen.extend(self._draw_stratum(numbers, count - len(chosen), taken))
+
+        self._random.shuffle(chosen)
+        return chosen
@@ -0,0 +1,117 @@
+"""Inverted index over question text and options, ranked with BM25.
+
+Text is NFKC-normalized and casefolded. Runs of CJK characters are indexed
+as overlapping character bigrams, since Chinese has no spaces to split
+words on; other text is indexed as words. Each bank has its own postings,
+so reloading a bank replaces just that bank's part of the index.
+"""
+import functools
+import math
+import re
+import threading
+import unicodedata
+
+# CJK ideographs (incl. extension A and compatibility), or runs of letters/digits
+TOKEN_PATTERN = r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[^\W_\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+'
+CJK_PATTERN = r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]'
+BM25_K1 = 1.2
+BM25_B = 0.75
+PHRASE_BOOST = 1.5
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').casefold()
+
+
+@functools.lru_cache(maxsize=None)
+def _patterns():
+    # Compiled on first use rather than at import: the Unicode classes take several ms to compile
+    return re.compile(TOKEN_PATTERN), re.compile(CJK_PATTERN)
+
+
+def tokenize(text):
+    token_re, cjk_re = _patterns()
+    tokens = []
+    for run in token_re.findall(normalize(text)):
+        if cjk_re.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def _document_text(question):
+    return '\n'.join([question.question_text or ''] + list(question.options))
+
+
+class _BankIndex:
+    __slots__ = ('postings', 'lengths', 'texts', 'total_length')
+
+    def __init__(self, questions):
+        self.postings = {}  # token -> {question_number: term frequency}
+        self.lengths = {}
+        self.texts = {}  # normalized text, for the exact-phrase boost
+        for q in questions:
+            text = _document_text(q)
+            tokens = tokenize(text)
+            self.lengths[q.question_number] = len(tokens)
+            self.texts[q.question_number] = normalize(text)
+            for token in tokens:
+                tf = self.postings.setdefault(token, {})
+                tf[q.question_number] = tf.get(q.question_number, 0) + 1
+        self.total_length = sum(self.lengths.values())
+
+
+class SearchIndex:
+    def __init__(self):
+        self._banks = {}
+        self._lock = threading.Lock()
+
+    def update_bank(self, quiz_id, questions):
+        """(Re)index one bank; the new index is built first and swapped in"""
+        index = _BankIndex(questions)
+        with self._lock:
+            banks = dict(self._banks)
+            banks[quiz_id] = index
+            self._banks = banks
+
+    def remove_bank(self, quiz_id):
+        with self._lock:
+            banks = dict(self._banks)
+            banks.pop(quiz_id, None)
+            self._banks = banks
+
+    def search(self, query, quiz_ids=None, limit=20):
+        """[(score, quiz_id, question_number)] best first"""
+        banks = self._banks
+        if quiz_ids is not None:
+            banks = {quiz_id: banks[quiz_id] for quiz_id in quiz_ids if quiz_id in banks}
+        terms = set(tokenize(query))
+        if not terms or not banks:
+            return []
+
+        doc_count = sum(len(b.lengths) for b in banks.values())
+        avg_length = (sum(b.total_length for b in banks.values()) / doc_count) if doc_count else 0
+        idf = {}
+        for term in terms:
+            df = sum(len(b.postings.get(term, ())) for b in banks.values())
+            if df:
+                idf[term] = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+        phrase = normalize(query).strip()
+        results = []
+        for quiz_id, bank in banks.items():
+            scores = {}
+            for term, term_idf in idf.items():
+                for number, tf in bank.postings.get(term, {}).items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * bank.lengths[number] / avg_length)
+                    scores[number] = scores.get(number, 0) + term_idf * tf * (BM25_K1 + 1) / (tf + norm)
+            for number, score in scores.items():
+                if phrase and phrase in bank.texts[number]:
+                    score *= PHRASE_BOOST
+                results.append((round(score, 4), quiz_id, number))
+        results.sort(key=lambda r: (-r[0], r[1], r[2]))
+        return results[:limit]
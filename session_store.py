@@ -0,0 +1,225 @@
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from helpers import LocalConnection
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """Session whose data lives on the server; the cookie only carries the ID"""
+
+    def __init__(self, initial=None, sid=None, new=False, blob=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # Serialized form as last loaded or saved, used to skip writes when nothing changed
+        # (routes mutate nested dicts/lists, which CallbackDict cannot see)
+        self.blob = blob
+
+
+class MemorySessionStore:
+    """In-process LRU store with TTL eviction"""
+
+    def __init__(self, max_entries=10000, ttl=7 * 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sid):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            blob, expires = entry
+            if expires < now:
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+            return blob
+
+    def set(self, sid, blob):
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._data[sid] = (blob, expires)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def touch(self, sid):
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is not None:
+                self._data[sid] = (entry[0], time.time() + self.ttl)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class SQLiteSessionStore:
+    """On-disk store; safe to share between worker processes on one host"""
+
+    def __init__(self, path, ttl=7 * 24 * 3600, purge_interval=600):
+        self.path = str(path)
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._last_purge = 0
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._connect = LocalConnection(self.path, isolation_level=None)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS sessions ('
+                'sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires)')
+
+    def get(self, sid):
+        row = self._connect().execute(
+            'SELECT data FROM sessions WHERE sid = ? AND expires >= ?', (sid, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid, blob):
+        now = time.time()
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO sessions (sid, data, expires) VALUES (?, ?, ?)',
+            (sid, blob, now + self.ttl)
+        )
+        if now - self._last_purge > self.purge_interval:
+            self._last_purge = now
+            conn.execute('DELETE FROM sessions WHERE expires < ?', (now,))
+
+    def touch(self, sid):
+        self._connect().execute(
+            'UPDATE sessions SET expires = ? WHERE sid = ?', (time.time() + self.ttl, sid)
+        )
+
+    def delete(self, sid):
+        self._connect().execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+
+class StateSessionStore:
+    """Sessions kept in a shared StateStore, so any node can serve any request (no sticky sessions)"""
+
+    def __init__(self, state, ttl=7 * 24 * 3600):
+        self.state = state
+        self.ttl = ttl
+
+    def get(self, sid):
+        # Another node may have written this session a moment ago, so never serve it from a cache
+        return self.state.get(f'session:{sid}', cache=False)
+
+    def set(self, sid, blob):
+        self.state.set(f'session:{sid}', blob, ttl=self.ttl)
+
+    def touch(self, sid):
+        self.state.touch(f'session:{sid}', self.ttl)
+
+    def delete(self, sid):
+        self.state.delete(f'session:{sid}')
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps only a random session ID in the cookie and the data in a store"""
+
+    session_class = ServerSideSession
+
+    def __init__(self, store):
+        self.store = store
+
+    @staticmethod
+    def _valid_sid(sid):
+        return bool(sid) and len(sid) <= 64 and sid.replace('-', '').replace('_', '').isalnum()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if self._valid_sid(sid):
+            blob = self.store.get(sid)
+            if blob is not None:
+                return self.session_class(json.loads(blob), sid=sid, blob=blob)
+        return self.session_class(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        blob = json.dumps(dict(session), separators=(',', ':'), ensure_ascii=False)
+        if blob != session.blob:
+            self.store.set(session.sid, blob)
+            session.blob = blob
+        elif self.should_set_cookie(app, session):
+            self.store.touch(session.sid)
+
+        if session.new or self.should_set_cookie(app, session):
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+            response.vary.add('Cookie')
+
+
+def load_secret_key(path):
+    """Read the signing key from path, creating it once (race-free across workers) if missing"""
+    path = Path(path)
+    try:
+        return path.read_text().strip()
+    except FileNotFoundError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    key = secrets.token_hex(32)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return path.read_text().strip()  # another worker won the race
+    with os.fdopen(fd, 'w') as f:
+        f.write(key)
+    return key
+
+
+def init_session_store(app, state=None):
+    """Install the session backend named by SESSION_BACKEND (memory, sqlite, shared or cookie)"""
+    backend = app.config.get('SESSION_BACKEND', 'memory')
+    ttl = int(app.permanent_session_lifetime.total_seconds())
+    if backend == 'cookie':
+        return None
+    if backend == 'memory':
+        store = MemorySessionStore(
+            max_entries=app.config.get('SESSION_MAX_ENTRIES', 10000), ttl=ttl
+        )
+    elif backend == 'sqlite':
+        path = app.config.get('SESSION_SQLITE_PATH') or Path(app.instance_path) / 'sessions.sqlite3'
+        store = SQLiteSessionStore(path, ttl=ttl)
+    elif backend == 'shared':
+        if state is None:
+            raise ValueError("SESSION_BACKEND 'shared' needs a StateStore")
+        store = StateSessionStore(state, ttl=ttl)
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
+    app.session_interface = ServerSideSessionInterface(store)
+    return store
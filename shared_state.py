@@ -0,0 +1,219 @@
+"""Key-value state shared by every node that serves the app.
+
+StateStore is the interface a networked backend (Redis, a SQL database, ...)
+implements. SQLiteStateStore is the stand-in for tests and single-host
+deployments: every worker on the host shares the file. CachedStateStore can
+wrap any backend. It adds a short-lived read cache per node, and batches
+writes that are allowed to land late (write-behind, e.g. session expiry
+refreshes). Anything that must be consistent across nodes reads with
+cache=False and writes through.
+
+Values are strings (callers serialize); counters are integers.
+"""
+import time
+from pathlib import Path
+
+from helpers import BatchWriter, LocalConnection
+
+
+class StateStore:
+    def get(self, key, cache=True):
+        """Value or None; cache=False asks caching wrappers to read through"""
+        raise NotImplementedError
+
+    def get_many(self, keys, cache=True):
+        """[value or None for each key]"""
+        return [self.get(key, cache) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def set_many(self, items, ttl=None):
+        for key, value in items:
+            self.set(key, value, ttl)
+
+    def set_later(self, key, value, ttl=None):
+        """A write that may reach other nodes late; stores without write-behind write through"""
+        self.set(key, value, ttl)
+
+    def flush(self):
+        """Write anything set_later or touch queued"""
+
+    def touch(self, key, ttl):
+        """Push back the expiry of an existing key"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key, amount=1, limit=None):
+        """Atomically add amount and return the new value; None (and no change) if it would exceed limit"""
+        raise NotImplementedError
+
+
+class SQLiteStateStore(StateStore):
+    def __init__(self, path, purge_interval=600):
+        self.path = str(path)
+        self.purge_interval = purge_interval
+        self._last_purge = 0
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._connect = LocalConnection(self.path, isolation_level=None)
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS state ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)'
+        )
+
+    @staticmethod
+    def _expires(ttl):
+        return time.time() + ttl if ttl else None
+
+    def get(self, key, cache=True):
+        row = self._connect().execute(
+            'SELECT value FROM state WHERE key = ? AND (expires IS NULL OR expires >= ?)', (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, keys, cache=True):
+        values = {}
+        now = time.time()
+        conn = self._connect()
+        for start in range(0, len(keys), 500):  # stay under SQLite's bound parameter limit
+            chunk = keys[start:start + 500]
+            values.update(conn.execute(
+                f'SELECT key, value FROM state WHERE key IN ({",".join("?" * len(chunk))}) '
+                'AND (expires IS NULL OR expires >= ?)', (*chunk, now)))
+        return [values.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        self.set_many([(key, value)], ttl)
+
+    def set_many(self, items, ttl=None):
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN')
+            conn.executemany('INSERT OR REPLACE INTO state (key, value, expires) VALUES (?, ?, ?)',
+                             [(key, value, self._expires(ttl)) for key, value in items])
+        if now - self._last_purge > self.purge_interval:
+            self._last_purge = now
+            conn.execute('DELETE FROM state WHERE expires < ?', (now,))
+
+    def touch(self, key, ttl):
+        self._connect().execute('UPDATE state SET expires = ? WHERE key = ?', (self._expires(ttl), key))
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM state WHERE key = ?', (key,))
+
+    def incr(self, key, amount=1, limit=None):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')  # take the write lock before reading
+            row = conn.execute(
+                'SELECT value FROM state WHERE key = ? AND (expires IS NULL OR expires >= ?)', (key, time.time())
+            ).fetchone()
+            value = (int(row[0]) if row else 0) + amount
+            if limit is not None and value > limit:
+                return None
+            conn.execute('INSERT OR REPLACE INTO state (key, value, expires) VALUES (?, ?, NULL)', (key, str(value)))
+        return value
+
+
+class CachedStateStore(BatchWriter, StateStore):
+    flusher_name = 'state-flusher'
+
+    def __init__(self, backend, cache_ttl=1.0, flush_interval=0.5, batch_size=100):
+        super().__init__(flush_interval, batch_size)
+        self.backend = backend
+        self.cache_ttl = cache_ttl
+        self._cache = {}  # key -> (value, fetched_at)
+        self._pending_sets = {}  # key -> (value, ttl)
+        self._pending_touches = {}  # key -> ttl
+
+    def get(self, key, cache=True):
+        with self._lock:
+            if key in self._pending_sets:
+                return self._pending_sets[key][0]
+            entry = self._cache.get(key)
+        if cache and entry is not None and time.monotonic() - entry[1] < self.cache_ttl:
+            return entry[0]
+        value = self.backend.get(key)
+        with self._lock:
+            self._cache[key] = (value, time.monotonic())
+            if len(self._cache) > 10000:
+                self._cache.clear()
+        return value
+
+    def get_many(self, keys, cache=True):
+        if cache:
+            return super().get_many(keys)
+        with self._lock:
+            pending = {key: self._pending_sets[key][0] for key in keys if key in self._pending_sets}
+        missing = [key for key in keys if key not in pending]
+        fetched = dict(zip(missing, self.backend.get_many(missing)))
+        now = time.monotonic()
+        with self._lock:
+            for key, value in fetched.items():
+                self._cache[key] = (value, now)
+            if len(self._cache) > 10000:
+                self._cache.clear()
+        return [pending[key] if key in pending else fetched[key] for key in keys]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._pending_sets.pop(key, None)
+            self._cache[key] = (value, time.monotonic())
+        self.backend.set(key, value, ttl)
+
+    def set_later(self, key, value, ttl=None):
+        """Write-behind: visible on this node at once, on other nodes after the next flush"""
+        with self._lock:
+            self._pending_sets[key] = (value, ttl)
+            self._cache[key] = (value, time.monotonic())
+        self._queued()
+
+    def touch(self, key, ttl):
+        """Expiry refreshes are batched; a late one only delays expiry"""
+        with self._lock:
+            self._pending_touches[key] = ttl
+        self._queued()
+
+    def delete(self, key):
+        with self._lock:
+            self._pending_sets.pop(key, None)
+            self._pending_touches.pop(key, None)
+            self._cache.pop(key, None)
+        self.backend.delete(key)
+
+    def incr(self, key, amount=1, limit=None):
+        value = self.backend.incr(key, amount, limit)
+        if value is not None:
+            with self._lock:
+                self._cache[key] = (str(value), time.monotonic())
+        return value
+
+    def _pending_count(self):
+        return len(self._pending_sets) + len(self._pending_touches)
+
+    def _take_batch(self):
+        if not self._pending_sets and not self._pending_touches:
+            return None
+        batch = (self._pending_sets, self._pending_touches)
+        self._pending_sets, self._pending_touches = {}, {}
+        return batch
+
+    def _restore_batch(self, batch):
+        # Newer writes win over the retried ones
+        sets, touches = batch
+        self._pending_sets = {**sets, **self._pending_sets}
+        self._pending_touches = {**touches, **self._pending_touches}
+
+    def _write_batch(self, batch):
+        sets, touches = batch
+        by_ttl = {}
+        for key, (value, ttl) in sets.items():
+            by_ttl.setdefault(ttl, []).append((key, value))
+        for ttl, items in by_ttl.items():
+            self.backend.set_many(items, ttl)
+        for key, ttl in touches.items():
+            if key not in sets:
+                self.backend.touch(key, ttl)
@@ -0,0 +1,18 @@
+"""Production WSGI entry point:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+gunicorn.conf.py sets preload_app, so this module is imported once in the
+master. Every bank is loaded here, before the workers fork, and the workers
+share those pages copy-on-write instead of each parsing its own copy.
+
+With QUIZ_BACKGROUND_LOAD=1 the master skips that step and every worker
+loads the banks on a background thread after forking (see gunicorn.conf.py).
+Workers then answer health checks at once, at the cost of the shared copy.
+"""
+from app import BACKGROUND_LOAD, app, quiz_manager
+
+if quiz_manager and not BACKGROUND_LOAD:
+    quiz_manager.load_all_quizzes()
+
+application = app